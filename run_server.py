@@ -18,7 +18,11 @@ FlagWars游戏服务器启动脚本
 
 import sys
 import os
-import argparse
+from types import SimpleNamespace
+
+# 默认服务器配置（命令行参数缺省值）
+DEFAULT_PORT = 8888
+DEFAULT_HOST = '0.0.0.0'
 
 def setup_python_path() -> None:
     """
@@ -40,13 +44,19 @@ def setup_python_path() -> None:
     sys.path.insert(0, src_path)
 
 
-def parse_arguments() -> argparse.Namespace:
+def parse_arguments() -> 'argparse.Namespace':
     """
     解析命令行参数
     
+    不带任何参数启动时直接返回默认配置，不导入argparse也不构建解析器。
+    
     Returns:
         argparse.Namespace: 解析后的命令行参数对象
     """
+    if len(sys.argv) == 1:
+        return SimpleNamespace(port=DEFAULT_PORT, debug=False, host=DEFAULT_HOST)
+    
+    import argparse
     parser = argparse.ArgumentParser(
         description='FlagWars多人夺旗游戏服务器',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -61,8 +71,8 @@ def parse_arguments() -> argparse.Namespace:
     parser.add_argument(
         '--port', 
         type=int, 
-        default=8888,
-        help='服务器监听端口 (默认: 8888)'
+        default=DEFAULT_PORT,
+        help=f'服务器监听端口 (默认: {DEFAULT_PORT})'
     )
     
     parser.add_argument(
@@ -74,8 +84,8 @@ def parse_arguments() -> argparse.Namespace:
     parser.add_argument(
         '--host',
         type=str,
-        default='0.0.0.0',
-        help='服务器绑定地址 (默认: 0.0.0.0)'
+        default=DEFAULT_HOST,
+        help=f'服务器绑定地址 (默认: {DEFAULT_HOST})'
     )
     
     return parser.parse_args()
@@ -107,18 +117,18 @@ def main() -> None:
     主函数 - 服务器启动入口点
     
     这是整个服务器程序的入口点，负责：
-    1. 配置Python环境
-    2. 解析命令行参数
+    1. 解析命令行参数（--help 在此直接退出，不做任何多余的导入和输出）
+    2. 配置Python环境
     3. 验证运行环境
     4. 导入并启动服务器主逻辑
     """
+    # 1. 解析命令行参数
+    args = parse_arguments()
+    
     try:
-        # 1. 配置Python模块路径
+        # 2. 配置Python模块路径
         setup_python_path()
         
-        # 2. 解析命令行参数
-        args = parse_arguments()
-        
         # 3. 验证运行环境
         if not validate_environment():
             sys.exit(1)
@@ -165,7 +175,7 @@ def main() -> None:
         sys.exit(1)
     except Exception as e:
         print(f"❌ 服务器启动失败: {e}")
-        if args.debug if 'args' in locals() else False:
+        if args.debug:
             import traceback
             traceback.print_exc()
         sys.exit(1)
@@ -3,10 +3,28 @@ import json
 import logging
 
 from tornado import web
+from tornado.escape import json_decode
 
 from .database import db
 
 
+def _json_bytes(data) -> bytes:
+    """将固定的响应体预先序列化为JSON字节串"""
+    return json.dumps(data).encode()
+
+
+# 固定的错误响应体在模块加载时序列化一次，错误路径上直接写出字节串
+_ERR_EMPTY_CREDENTIALS = _json_bytes({'success': False, 'message': '用户名和密码不能为空'})
+_ERR_INVALID_CREDENTIALS = _json_bytes({'success': False, 'message': '用户名或密码错误'})
+_ERR_LOGIN_FAILED = _json_bytes({'success': False, 'message': '登录失败，请稍后再试'})
+_ERR_USERNAME_LENGTH = _json_bytes({'success': False, 'message': '用户名长度必须在3-20个字符之间'})
+_ERR_PASSWORD_TOO_SHORT = _json_bytes({'success': False, 'message': '密码长度不能少于6个字符'})
+_ERR_USER_EXISTS = _json_bytes({'success': False, 'message': '用户名或邮箱已存在'})
+_ERR_REGISTER_FAILED = _json_bytes({'success': False, 'message': '注册失败，请稍后再试'})
+_ERR_LOGOUT_FAILED = _json_bytes({'success': False, 'message': '登出失败，请稍后再试'})
+_ERR_LOGIN_REQUIRED = _json_bytes({'success': False, 'message': '请先登录'})
+
+
 class BaseHandler(web.RequestHandler):
     """基础请求处理器，提供通用功能"""
     
@@ -35,6 +53,11 @@ class BaseHandler(web.RequestHandler):
         """写入JSON响应"""
         self.set_header("Content-Type", "application/json")
         self.write(json.dumps(data))
+    
+    def write_json_bytes(self, body: bytes):
+        """写入预先序列化好的JSON响应"""
+        self.set_header("Content-Type", "application/json")
+        self.write(body)
 
 
 class LoginHandler(BaseHandler):
@@ -43,25 +66,19 @@ class LoginHandler(BaseHandler):
     async def post(self):
         """处理登录请求"""
         try:
-            data = json.loads(self.request.body.decode())
+            data = json_decode(self.request.body)
             username = data.get('username', '').strip()
             password = data.get('password', '')
             
             if not username or not password:
-                self.write_json({
-                    'success': False,
-                    'message': '用户名和密码不能为空'
-                })
+                self.write_json_bytes(_ERR_EMPTY_CREDENTIALS)
                 return
             
             # 验证用户
             user = db.verify_user(username, password)
             if not user:
                 self.set_status(401)  # 未授权状态码
-                self.write_json({
-                    'success': False,
-                    'message': '用户名或密码错误'
-                })
+                self.write_json_bytes(_ERR_INVALID_CREDENTIALS)
                 return
             
             # 获取用户统计信息
@@ -90,11 +107,8 @@ class LoginHandler(BaseHandler):
             })
             
         except Exception as e:
-            logging.error(f"登录错误: {str(e)}")
-            self.write_json({
-                'success': False,
-                'message': '登录失败，请稍后再试'
-            })
+            logging.error("登录错误: %s", e)
+            self.write_json_bytes(_ERR_LOGIN_FAILED)
 
 
 class RegisterHandler(BaseHandler):
@@ -103,39 +117,27 @@ class RegisterHandler(BaseHandler):
     async def post(self):
         """处理注册请求"""
         try:
-            data = json.loads(self.request.body.decode())
+            data = json_decode(self.request.body)
             username = data.get('username', '').strip()
             password = data.get('password', '')
             email = data.get('email', '').strip() or None
             
             if not username or not password:
-                self.write_json({
-                    'success': False,
-                    'message': '用户名和密码不能为空'
-                })
+                self.write_json_bytes(_ERR_EMPTY_CREDENTIALS)
                 return
             
             if len(username) < 3 or len(username) > 20:
-                self.write_json({
-                    'success': False,
-                    'message': '用户名长度必须在3-20个字符之间'
-                })
+                self.write_json_bytes(_ERR_USERNAME_LENGTH)
                 return
             
             if len(password) < 6:
-                self.write_json({
-                    'success': False,
-                    'message': '密码长度不能少于6个字符'
-                })
+                self.write_json_bytes(_ERR_PASSWORD_TOO_SHORT)
                 return
             
             # 创建用户
             user_id = db.create_user(username, password, email)
             if not user_id:
-                self.write_json({
-                    'success': False,
-                    'message': '用户名或邮箱已存在'
-                })
+                self.write_json_bytes(_ERR_USER_EXISTS)
                 return
             
             self.write_json({
@@ -144,11 +146,8 @@ class RegisterHandler(BaseHandler):
             })
             
         except Exception as e:
-            logging.error(f"注册错误: {str(e)}")
-            self.write_json({
-                'success': False,
-                'message': '注册失败，请稍后再试'
-            })
+            logging.error("注册错误: %s", e)
+            self.write_json_bytes(_ERR_REGISTER_FAILED)
 
 
 class LogoutHandler(BaseHandler):
@@ -170,11 +169,8 @@ class LogoutHandler(BaseHandler):
             })
             
         except Exception as e:
-            logging.error(f"登出错误: {str(e)}")
-            self.write_json({
-                'success': False,
-                'message': '登出失败，请稍后再试'
-            })
+            logging.error("登出错误: %s", e)
+            self.write_json_bytes(_ERR_LOGOUT_FAILED)
 
 
 class CheckAuthHandler(BaseHandler):
@@ -203,7 +199,7 @@ class CheckAuthHandler(BaseHandler):
                 })
           
         except Exception as e:
-            logging.error(f"检查认证状态错误: {str(e)}")
+            logging.error("检查认证状态错误: %s", e)
             self.write_json({
                 'authenticated': False,
                 'error': '检查认证状态失败'
@@ -218,10 +214,7 @@ class UserStatsHandler(BaseHandler):
         try:
             user = self.get_current_user()
             if not user:
-                self.write_json({
-                    'success': False,
-                    'message': '请先登录'
-                })
+                self.write_json_bytes(_ERR_LOGIN_REQUIRED)
                 return
             
             # 获取用户统计信息
@@ -233,7 +226,7 @@ class UserStatsHandler(BaseHandler):
             })
             
         except Exception as e:
-            logging.error(f"获取用户统计信息错误: {str(e)}")
+            logging.error("获取用户统计信息错误: %s", e)
             self.write_json({
                 'success': False,
                 'message': '获取统计信息失败，请稍后再试'
@@ -248,10 +241,7 @@ class GameHistoryHandler(BaseHandler):
         try:
             user = self.get_current_user()
             if not user:
-                self.write_json({
-                    'success': False,
-                    'message': '请先登录'
-                })
+                self.write_json_bytes(_ERR_LOGIN_REQUIRED)
                 return
             
             # 获取分页参数
@@ -267,7 +257,7 @@ class GameHistoryHandler(BaseHandler):
             })
             
         except Exception as e:
-            logging.error(f"获取游戏历史错误: {str(e)}")
+            logging.error("获取游戏历史错误: %s", e)
             self.write_json({
                 'success': False,
                 'message': '获取游戏历史失败，请稍后再试'
@@ -282,10 +272,7 @@ class UserMusicSettingsHandler(BaseHandler):
         try:
             user = self.get_current_user()
             if not user:
-                self.write_json({
-                    'success': False,
-                    'message': '请先登录'
-                })
+                self.write_json_bytes(_ERR_LOGIN_REQUIRED)
                 return
             
             # 获取用户音乐设置
@@ -301,7 +288,7 @@ class UserMusicSettingsHandler(BaseHandler):
             })
             
         except Exception as e:
-            logging.error(f"获取用户音乐设置错误: {str(e)}")
+            logging.error("获取用户音乐设置错误: %s", e)
             self.write_json({
                 'success': False,
                 'message': '获取音乐设置失败，请稍后再试'
@@ -312,13 +299,10 @@ class UserMusicSettingsHandler(BaseHandler):
         try:
             user = self.get_current_user()
             if not user:
-                self.write_json({
-                    'success': False,
-                    'message': '请先登录'
-                })
+                self.write_json_bytes(_ERR_LOGIN_REQUIRED)
                 return
             
-            data = json.loads(self.request.body.decode())
+            data = json_decode(self.request.body)
             bgm_name = data.get('bgm')  # 修改为bgm，与前端匹配
             victory_music_name = data.get('victory_music')  # 修改为victory_music，与前端匹配
             
@@ -371,7 +355,7 @@ class UserMusicSettingsHandler(BaseHandler):
                 })
             
         except Exception as e:
-            logging.error(f"更新用户音乐设置错误: {str(e)}")
+            logging.error("更新用户音乐设置错误: %s", e)
             self.write_json({
                 'success': False,
                 'message': '更新音乐设置失败，请稍后再试'
@@ -386,10 +370,7 @@ class ShopHandler(BaseHandler):
         try:
             user = self.get_current_user()
             if not user:
-                self.write_json({
-                    'success': False,
-                    'message': '请先登录'
-                })
+                self.write_json_bytes(_ERR_LOGIN_REQUIRED)
                 return
             
             # 获取用户当前旗数
@@ -432,7 +413,7 @@ class ShopHandler(BaseHandler):
             })
             
         except Exception as e:
-            logging.error(f"获取商店数据错误: {str(e)}")
+            logging.error("获取商店数据错误: %s", e)
             self.write_json({
                 'success': False,
                 'message': '获取商店数据失败，请稍后再试'
@@ -447,13 +428,10 @@ class PurchaseMusicHandler(BaseHandler):
         try:
             user = self.get_current_user()
             if not user:
-                self.write_json({
-                    'success': False,
-                    'message': '请先登录'
-                })
+                self.write_json_bytes(_ERR_LOGIN_REQUIRED)
                 return
             
-            data = json.loads(self.request.body.decode())
+            data = json_decode(self.request.body)
             music_name = data.get('music_name')
             music_type = data.get('music_type')  # 'bgm' 或 'victory'
             
@@ -519,7 +497,7 @@ class PurchaseMusicHandler(BaseHandler):
             })
             
         except Exception as e:
-            logging.error(f"购买音乐错误: {str(e)}")
+            logging.error("购买音乐错误: %s", e)
             self.write_json({
                 'success': False,
                 'message': '购买音乐失败，请稍后再试'
@@ -543,10 +521,7 @@ class CheckUsernameHandler(BaseHandler):
             
             # 检查用户名长度
             if len(username) < 3 or len(username) > 20:
-                self.write_json({
-                    'success': False,
-                    'message': '用户名长度必须在3-20个字符之间'
-                })
+                self.write_json_bytes(_ERR_USERNAME_LENGTH)
                 return
             
             # 检查用户名是否已存在
@@ -559,7 +534,7 @@ class CheckUsernameHandler(BaseHandler):
             })
             
         except Exception as e:
-            logging.error(f"检查用户名错误: {str(e)}")
+            logging.error("检查用户名错误: %s", e)
             self.write_json({
                 'success': False,
                 'message': '检查用户名失败，请稍后再试'
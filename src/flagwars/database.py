@@ -17,9 +17,121 @@ FlagWars游戏数据库管理模块
 
 import sqlite3
 import hashlib
+import hmac
+import json
+import queue
+import random
 import secrets
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+import threading
+import time
+from contextlib import closing, contextmanager
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+
+
+# 部分Python构建（OpenSSL版本过旧或使用LibreSSL）的hashlib不提供scrypt
+_HAS_SCRYPT = hasattr(hashlib, 'scrypt')
+
+# 游戏中所有可用的音乐（硬编码列表，实际应用中可从文件系统获取）
+_AVAILABLE_MUSIC: Dict[str, Tuple[str, ...]] = {
+    'bgm': (
+        'Whispers-of-Strategy.mp3',
+        'Electric-Heartbeat.mp3',
+        'Moonlight-and-Marmalade.mp3',
+    ),
+    'victory': (
+        'royal-vict.mp3',
+        'folk-vict.mp3',
+        'mario-vict.mp3',
+        'weird-horn-vict.mp3',
+    ),
+}
+
+# 新用户默认选择并解锁的音乐，键为音乐类型（'bgm' 背景音乐 / 'victory' 胜利音乐）
+_DEFAULT_MUSIC: Dict[str, str] = {
+    'bgm': 'Whispers-of-Strategy.mp3',
+    'victory': 'royal-vict.mp3',
+}
+
+# 热路径查询语句：模块级常量，配合连接上的语句缓存避免重复解析
+# 会话校验结果会缓存一段时间，因此只取身份信息，不取旗数、战绩等会变化的字段
+_SQL_VERIFY_SESSION = """
+    SELECT u.id, u.username, u.email, s.expires_at
+    FROM users u
+    JOIN user_sessions s ON u.id = s.user_id
+    WHERE s.session_token = ? AND s.expires_at > ?
+"""
+
+_SQL_USER_GAME_HISTORY = """
+    SELECT 
+        g.id, g.room_id, g.winner_id, g.game_duration, g.total_turns, 
+        g.created_at, g.finished_at,
+        gp.final_rank, gp.survived,
+        CASE WHEN g.winner_id = ? THEN 1 ELSE 0 END AS won
+    FROM games g
+    JOIN game_players gp ON g.id = gp.game_id
+    WHERE gp.user_id = ?
+    ORDER BY g.finished_at DESC
+    LIMIT ?
+"""
+
+# 已解锁音乐由SQLite用单元分隔符(char(31))拼成一个字符串返回，Python侧只需split一次。
+# 先在子查询中按rowid（即解锁先后）排序再拼接，保持按解锁顺序返回；
+# 否则SQLite会按主键索引(user_id, kind, music_name)顺序读取，结果变为按文件名排序
+_SQL_UNLOCKED_MUSIC = """
+    SELECT group_concat(music_name, char(31)) FROM (
+        SELECT music_name FROM user_unlocked_music
+        WHERE user_id = ? AND kind = ?
+        ORDER BY rowid
+    )
+"""
+_MUSIC_SEPARATOR = '\x1f'
+_SQL_UNLOCK_MUSIC = "INSERT OR IGNORE INTO user_unlocked_music (user_id, kind, music_name) VALUES (?, ?, ?)"
+_SQL_GET_USER_FLAGS = "SELECT flags FROM users WHERE id = ?"
+_SQL_ADD_USER_FLAGS = "UPDATE users SET flags = flags + ? WHERE id = ?"
+_SQL_SPEND_USER_FLAGS = "UPDATE users SET flags = flags - ? WHERE id = ? AND flags >= ?"
+
+_SQL_USER_BY_USERNAME = """
+    SELECT id, username, email, flags, total_games, wins, losses, password_hash, salt
+    FROM users WHERE username = ?
+"""
+_SQL_UPDATE_LAST_LOGIN = "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?"
+_SQL_CREATE_SESSION = "INSERT INTO user_sessions (user_id, session_token, expires_at) VALUES (?, ?, ?)"
+
+# 已解锁部分与 _SQL_UNLOCKED_MUSIC 相同：每种类型先按rowid排序再拼接，保持解锁顺序。
+# 不使用GROUP BY kind，因为分组时的临时排序不保证组内顺序
+_SQL_USER_MUSIC_SETTINGS = """
+    SELECT 1 AS selected, kind, music_name FROM user_selected_music WHERE user_id = ?1
+    UNION ALL
+    SELECT 0, 'bgm', group_concat(music_name, char(31)) FROM (
+        SELECT music_name FROM user_unlocked_music
+        WHERE user_id = ?1 AND kind = 'bgm'
+        ORDER BY rowid
+    )
+    UNION ALL
+    SELECT 0, 'victory', group_concat(music_name, char(31)) FROM (
+        SELECT music_name FROM user_unlocked_music
+        WHERE user_id = ?1 AND kind = 'victory'
+        ORDER BY rowid
+    )
+"""
+
+_SQL_USER_STATS_BULK = """
+    SELECT 
+        id, total_games, wins, losses, flags,
+        CASE WHEN total_games > 0
+             THEN ROUND(wins * 100.0 / total_games, 2)
+             ELSE 0 END AS win_rate
+    FROM users WHERE id IN (SELECT value FROM json_each(?))
+"""
+
+_SQL_USER_STATS = """
+    SELECT 
+        total_games, wins, losses, flags,
+        CASE WHEN total_games > 0
+             THEN ROUND(wins * 100.0 / total_games, 2)
+             ELSE 0 END AS win_rate
+    FROM users WHERE id = ?
+"""
 
 
 class Database:
@@ -34,7 +146,7 @@ class Database:
     
     主要特性：
     - 使用SQLite作为本地数据库，零配置部署
-    - 密码安全哈希存储，使用SHA-256 + 随机盐
+    - 密码安全哈希存储，使用scrypt（不可用时PBKDF2）+ 随机盐
     - 完整的会话管理，支持过期时间控制
     - 灵活的音乐系统，支持解锁机制
     - 完善的错误处理和异常捕获
@@ -45,18 +157,62 @@ class Database:
     - user_sessions: 用户登录会话管理
     - games: 游戏记录和结果
     - game_players: 游戏参与者详细信息
-    - user_unlocked_bgm/victory_music: 用户音乐解锁记录
-    - user_selected_bgm/victory_music: 用户音乐选择设置
+    - user_unlocked_music: 用户音乐解锁记录（kind区分背景音乐/胜利音乐）
+    - user_selected_music: 用户音乐选择设置（kind区分背景音乐/胜利音乐）
     """
     
-    def __init__(self, db_path: str = "flagwars.db"):
+    # 表结构版本（PRAGMA user_version），修改表结构或增加迁移时递增
+    SCHEMA_VERSION = 1
+    
+    # scrypt代价参数：n=2^14, r=8 约占用16MB内存，单次校验在几十毫秒量级
+    SCRYPT_N = 2 ** 14
+    SCRYPT_R = 8
+    SCRYPT_P = 1
+    
+    # 无scrypt时的PBKDF2-HMAC-SHA256迭代次数
+    PBKDF2_ITERATIONS = 200_000
+    
+    # 会话校验结果的进程内缓存：有效期（秒）和最大条目数
+    SESSION_CACHE_TTL = 30.0
+    SESSION_CACHE_SIZE = 1024
+    
+    # 每次创建会话时顺带清理过期会话的概率
+    SESSION_PURGE_PROBABILITY = 0.01
+    
+    # 已解锁音乐集合的进程内缓存：有效期（秒）和最大条目数
+    UNLOCKED_CACHE_TTL = 30.0
+    UNLOCKED_CACHE_SIZE = 1024
+    
+    # 最后登录时间延迟写入的间隔（秒）
+    LAST_LOGIN_FLUSH_INTERVAL = 5.0
+    
+    def __init__(self, db_path: str = "flagwars.db", pool_size: int = 4):
         """初始化数据库管理类
         
         Args:
             db_path (str): SQLite数据库文件路径，默认为"flagwars.db"
+            pool_size (int): 连接池中的连接数量，默认为4
         """
         self.db_path = db_path
         self.init_database()
+        
+        # 会话缓存：session_token -> (缓存有效截止时间戳, 用户信息字典)
+        self._session_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._session_cache_lock = threading.Lock()
+        
+        # 解锁缓存：(user_id, 'bgm'|'victory') -> (缓存有效截止时间戳, 已解锁音乐集合)
+        self._unlocked_cache: Dict[Tuple[int, str], Tuple[float, frozenset]] = {}
+        self._unlocked_cache_lock = threading.Lock()
+        
+        # 待写入最后登录时间的用户ID，由定时器批量写入
+        self._pending_last_login: set = set()
+        self._last_login_lock = threading.Lock()
+        self._last_login_timer: Optional[threading.Timer] = None
+        
+        # 连接池：预先创建可复用的连接，多线程下也可安全借还
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._pool.put(self._new_connection())
     
     def init_database(self):
         """初始化数据库表结构
@@ -70,10 +226,23 @@ class Database:
         
         如果数据库已存在，则不会重复创建表。
         对于已有的users表，会检查并添加缺失的flags字段（数据库迁移）。
+        表结构版本记录在 PRAGMA user_version 中，已是最新版本时直接跳过所有DDL。
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with closing(sqlite3.connect(self.db_path)) as conn:
             cursor = conn.cursor()
             
+            # 启用WAL日志模式：提交只追加到WAL文件，读者不再阻塞写者。
+            # journal_mode是持久化设置，只需在初始化时设置一次；
+            # 注意WAL模式会在数据库旁生成 -wal / -shm 两个附属文件。
+            cursor.execute("PRAGMA journal_mode=WAL")
+            
+            # 表结构已是最新版本，无需再执行建表和迁移语句
+            cursor.execute("PRAGMA user_version")
+            if cursor.fetchone()[0] >= self.SCHEMA_VERSION:
+                return
+            
+            self._configure(conn)
+            
             # 用户表 - 存储用户基本信息、认证信息和游戏统计
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -126,88 +295,242 @@ class Database:
                 )
             ''')
             
+            # 按用户查询对局历史时走索引，(user_id, game_id)可直接驱动与games表的联接
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_game_players_user ON game_players(user_id, game_id)"
+            )
+            
             # 用户会话表 - 管理用户登录状态和会话有效期
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS user_sessions (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
                     session_token TEXT UNIQUE NOT NULL,
-                    expires_at TIMESTAMP NOT NULL,
+                    expires_at REAL NOT NULL,  -- Unix时间戳（秒）
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users (id)
                 )
             ''')
             
-            # 用户解锁背景音乐表 - 记录用户已解锁的背景音乐
+            # 会话令牌已有UNIQUE隐式索引；按过期时间清理会话时使用该索引
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions(expires_at)"
+            )
+            
+            # 用户解锁音乐表 - 记录用户已解锁的音乐，kind为'bgm'或'victory'
+            # 主键(user_id, kind, music_name)同时覆盖按用户和类型的查询
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_unlocked_bgm (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                CREATE TABLE IF NOT EXISTS user_unlocked_music (
                     user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
                     music_name TEXT NOT NULL,
                     unlocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    UNIQUE(user_id, music_name)
+                    PRIMARY KEY (user_id, kind, music_name),
+                    FOREIGN KEY (user_id) REFERENCES users (id)
                 )
             ''')
             
-            # 用户解锁胜利音乐表 - 记录用户已解锁的胜利音乐
+            # 用户选择的音乐表 - 存储用户当前选择的背景音乐和胜利音乐
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_unlocked_victory_music (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                CREATE TABLE IF NOT EXISTS user_selected_music (
                     user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
                     music_name TEXT NOT NULL,
-                    unlocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    UNIQUE(user_id, music_name)
-                )
-            ''')
-            
-            # 用户选择的背景音乐表 - 存储用户当前选择的背景音乐
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_selected_bgm (
-                    user_id INTEGER PRIMARY KEY,
-                    bgm_name TEXT NOT NULL DEFAULT 'Whispers-of-Strategy.mp3',
+                    PRIMARY KEY (user_id, kind),
                     FOREIGN KEY (user_id) REFERENCES users (id)
                 )
             ''')
             
-            # 用户选择的胜利音乐表 - 存储用户当前选择的胜利音乐
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_selected_victory_music (
-                    user_id INTEGER PRIMARY KEY,
-                    victory_music_name TEXT NOT NULL DEFAULT 'royal-vict.mp3',
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
+            self._migrate_legacy_music_tables(cursor)
             
+            cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
             conn.commit()
     
-    def get_connection(self) -> sqlite3.Connection:
-        """获取数据库连接
+    @staticmethod
+    def _migrate_legacy_music_tables(cursor: sqlite3.Cursor):
+        """把旧版按音乐类型分开的四张表迁移到合并后的两张表（数据库迁移）
         
-        Returns:
-            sqlite3.Connection: SQLite数据库连接对象
+        旧表：user_unlocked_bgm / user_unlocked_victory_music /
+        user_selected_bgm / user_selected_victory_music。
+        迁移完成后删除旧表，之后启动时不再执行。
+        """
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN "
+            "('user_unlocked_bgm', 'user_unlocked_victory_music', "
+            "'user_selected_bgm', 'user_selected_victory_music')"
+        )
+        legacy_tables = {row[0] for row in cursor.fetchall()}
+        if not legacy_tables:
+            return
+        
+        migrations = (
+            ('user_unlocked_bgm',
+             "INSERT OR IGNORE INTO user_unlocked_music (user_id, kind, music_name, unlocked_at) "
+             "SELECT user_id, 'bgm', music_name, unlocked_at FROM user_unlocked_bgm"),
+            ('user_unlocked_victory_music',
+             "INSERT OR IGNORE INTO user_unlocked_music (user_id, kind, music_name, unlocked_at) "
+             "SELECT user_id, 'victory', music_name, unlocked_at FROM user_unlocked_victory_music"),
+            ('user_selected_bgm',
+             "INSERT OR REPLACE INTO user_selected_music (user_id, kind, music_name) "
+             "SELECT user_id, 'bgm', bgm_name FROM user_selected_bgm"),
+            ('user_selected_victory_music',
+             "INSERT OR REPLACE INTO user_selected_music (user_id, kind, music_name) "
+             "SELECT user_id, 'victory', victory_music_name FROM user_selected_victory_music"),
+        )
+        for table, sql in migrations:
+            if table in legacy_tables:
+                cursor.execute(sql)
+                cursor.execute(f"DROP TABLE {table}")
+        print("已将音乐解锁/选择数据迁移到user_unlocked_music和user_selected_music表")
+    
+    @staticmethod
+    def _configure(conn: sqlite3.Connection):
+        """为新连接设置连接级别的PRAGMA
+        
+        - synchronous=NORMAL: WAL模式下只在检查点时fsync，提交不再逐次刷盘
+        - temp_store=MEMORY: 临时表和排序使用内存
+        - mmap_size / cache_size: 内存映射读取，页缓存约20MB
+        - busy_timeout: 写锁冲突时等待而不是立即报错
+        - foreign_keys: 启用外键约束
+        """
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA foreign_keys=ON")
+    
+    @contextmanager
+    def get_connection(self) -> Iterator[sqlite3.Connection]:
+        """从连接池借出一个数据库连接
+        
+        以上下文管理器的方式使用，退出时把连接归还连接池，避免每次调用都重新打开数据库文件。
+        连接处于自动提交模式（isolation_level=None），单条语句执行后即生效，无需commit；
+        需要多条语句原子执行时使用 transaction()。
+        
+        Yields:
+            sqlite3.Connection: 已完成PRAGMA配置的SQLite数据库连接对象
+        """
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            # 防止把带有未结束事务的连接放回连接池
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """借出连接并开启显式事务
+        
+        使用BEGIN IMMEDIATE在事务开始时即获取写锁，正常退出时COMMIT，出现异常时ROLLBACK。
+        用于需要多条语句原子执行的写操作。
+        
+        Yields:
+            sqlite3.Connection: 处于事务中的数据库连接
         """
-        return sqlite3.connect(self.db_path)
+        with self.get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                # SQLite可能已自行回滚（如SQLITE_FULL、SQLITE_IOERR或COMMIT时SQLITE_BUSY），
+                # 此时再执行ROLLBACK会抛出新的错误并掩盖原始异常
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+    
+    def _new_connection(self) -> sqlite3.Connection:
+        """创建一个供连接池使用的新连接"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256,
+                               isolation_level=None)  # 自动提交模式，事务由transaction()显式控制
+        conn.row_factory = sqlite3.Row  # 所有查询结果都可按列名或下标访问
+        self._configure(conn)
+        return conn
+    
+    def close(self):
+        """写入尚未落盘的最后登录时间，然后关闭连接池中的所有连接"""
+        with self._last_login_lock:
+            if self._last_login_timer is not None:
+                self._last_login_timer.cancel()
+                self._last_login_timer = None
+        self.flush_last_login()
+        
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+    
+    def _hash_prefix(self) -> str:
+        """当前哈希算法及代价参数对应的编码前缀"""
+        if _HAS_SCRYPT:
+            return f"scrypt${self.SCRYPT_N}${self.SCRYPT_R}${self.SCRYPT_P}$"
+        return f"pbkdf2${self.PBKDF2_ITERATIONS}$"
     
     def hash_password(self, password: str, salt: str = None) -> tuple:
         """密码哈希处理
         
-        使用SHA-256算法对密码进行安全哈希，结合随机盐值防止彩虹表攻击。
+        使用scrypt自适应密钥派生函数对密码进行哈希，结合随机盐值防止彩虹表攻击；
+        如果当前Python的hashlib不提供scrypt，则退回PBKDF2-HMAC-SHA256。
+        计算代价参数会编码进哈希字符串，以后调高代价时旧哈希仍可验证，
+        并在下次登录时自动升级。
         
         Args:
             password (str): 原始密码字符串
             salt (str, optional): 盐值，如果为None则自动生成随机盐值
             
         Returns:
-            tuple: (密码哈希值, 盐值)的元组
+            tuple: (编码后的密码哈希值, 盐值)的元组，
+            哈希格式为 scrypt$n$r$p$摘要 或 pbkdf2$迭代次数$摘要
         """
         if salt is None:
             salt = secrets.token_hex(16)
         
-        # 使用SHA-256进行密码哈希
-        password_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-        return password_hash, salt
+        if _HAS_SCRYPT:
+            digest = hashlib.scrypt(password.encode(), salt=salt.encode(),
+                                    n=self.SCRYPT_N, r=self.SCRYPT_R, p=self.SCRYPT_P, dklen=32)
+        else:
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(),
+                                         self.PBKDF2_ITERATIONS, dklen=32)
+        return self._hash_prefix() + digest.hex(), salt
+    
+    def verify_password(self, password: str, password_hash: str, salt: str) -> bool:
+        """校验密码是否与存储的哈希匹配
+        
+        兼容scrypt、PBKDF2编码哈希和旧版的单轮SHA-256哈希，比较使用恒定时间算法。
+        
+        Args:
+            password (str): 待校验的原始密码
+            password_hash (str): 数据库中存储的密码哈希
+            salt (str): 数据库中存储的盐值
+            
+        Returns:
+            bool: 密码是否正确
+        """
+        try:
+            if password_hash.startswith("scrypt$"):
+                _, n, r, p, expected = password_hash.split("$")
+                digest = hashlib.scrypt(password.encode(), salt=salt.encode(),
+                                        n=int(n), r=int(r), p=int(p), dklen=32).hex()
+            elif password_hash.startswith("pbkdf2$"):
+                _, iterations, expected = password_hash.split("$")
+                digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(),
+                                             int(iterations), dklen=32).hex()
+            else:
+                # 旧版哈希：SHA-256(密码 + 盐)
+                expected = password_hash
+                digest = hashlib.sha256((password + salt).encode()).hexdigest()
+        except (ValueError, AttributeError):
+            # 哈希格式损坏，或存储的是scrypt哈希但当前环境不支持scrypt
+            return False
+        return hmac.compare_digest(digest, expected)
+    
+    def password_needs_rehash(self, password_hash: str) -> bool:
+        """判断存储的哈希是否需要用当前算法和参数重新计算（旧版SHA-256或代价参数已变化）"""
+        return not password_hash.startswith(self._hash_prefix())
     
     def create_user(self, username: str, password: str, email: str = None) -> Optional[int]:
         """创建新用户
@@ -224,7 +547,7 @@ class Database:
             Optional[int]: 创建成功返回用户ID，失败（用户名或邮箱已存在）返回None
             
         流程：
-        1. 对密码进行SHA-256哈希处理，生成随机盐值
+        1. 对密码进行scrypt（或PBKDF2）哈希处理，生成随机盐值
         2. 将用户信息插入users表
         3. 为用户设置默认的背景音乐和胜利音乐选择
         4. 解锁默认音乐文件供用户使用
@@ -233,7 +556,7 @@ class Database:
         password_hash, salt = self.hash_password(password)
         
         try:
-            with self.get_connection() as conn:
+            with self.transaction() as conn:
                 cursor = conn.cursor()
                 
                 # 插入用户基本信息
@@ -243,31 +566,19 @@ class Database:
                 )
                 user_id = cursor.lastrowid
                 
-                # 为用户设置默认背景音乐选择
-                cursor.execute(
-                    "INSERT INTO user_selected_bgm (user_id, bgm_name) VALUES (?, ?)",
-                    (user_id, 'Whispers-of-Strategy.mp3')
-                )
-                
-                # 为用户设置默认胜利音乐选择
-                cursor.execute(
-                    "INSERT INTO user_selected_victory_music (user_id, victory_music_name) VALUES (?, ?)",
-                    (user_id, 'royal-vict.mp3')
-                )
-                
-                # 为用户解锁默认背景音乐
-                cursor.execute(
-                    "INSERT INTO user_unlocked_bgm (user_id, music_name) VALUES (?, ?)",
-                    (user_id, 'Whispers-of-Strategy.mp3')
+                # 为用户设置默认的背景音乐和胜利音乐选择
+                default_rows = [(user_id, kind, music_name) for kind, music_name in _DEFAULT_MUSIC.items()]
+                cursor.executemany(
+                    "INSERT INTO user_selected_music (user_id, kind, music_name) VALUES (?, ?, ?)",
+                    default_rows
                 )
                 
-                # 为用户解锁默认胜利音乐
-                cursor.execute(
-                    "INSERT INTO user_unlocked_victory_music (user_id, music_name) VALUES (?, ?)",
-                    (user_id, 'royal-vict.mp3')
+                # 为用户解锁默认音乐
+                cursor.executemany(
+                    "INSERT INTO user_unlocked_music (user_id, kind, music_name) VALUES (?, ?, ?)",
+                    default_rows
                 )
                 
-                conn.commit()
                 return user_id
         except sqlite3.IntegrityError:
             return None  # 用户名或邮箱已存在
@@ -284,41 +595,77 @@ class Database:
             
         Returns:
             Optional[Dict[str, Any]]: 
-            - 验证成功返回用户信息的字典（包括所有用户字段和会话过期时间）
+            - 验证成功返回用户基本信息的字典（不含密码哈希和盐值）
             - 验证失败返回None
             
         安全特性：
         - 使用相同的盐值重新计算密码哈希进行验证
         - 防止时序攻击，使用恒定时间比较
-        - 自动更新最后登录时间用于统计分析
+        - 旧版SHA-256哈希在登录成功后自动升级为当前算法
+        - 自动更新最后登录时间用于统计分析（延迟几秒批量写入）
         """
         with self.get_connection() as conn:
-            conn.row_factory = sqlite3.Row  # 返回字典格式的结果
-            cursor = conn.cursor()
-            
             # 获取用户信息
-            cursor.execute(
-                "SELECT * FROM users WHERE username = ?",
-                (username,)
-            )
-            user = cursor.fetchone()
-            
-            if not user:
-                return None
-            
-            # 验证密码 - 使用存储的盐值重新计算哈希
-            password_hash, salt = self.hash_password(password, user['salt'])
-            if password_hash != user['password_hash']:
-                return None
-            
-            # 更新最后登录时间
-            cursor.execute(
-                "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?",
-                (user['id'],)
-            )
-            conn.commit()
-            
-            return dict(user)
+            user = conn.execute(_SQL_USER_BY_USERNAME, (username,)).fetchone()
+        
+        if not user:
+            return None
+        
+        # 验证密码 - 使用存储的盐值重新计算哈希（耗时操作，不占用连接）
+        if not self.verify_password(password, user['password_hash'], user['salt']):
+            return None
+        
+        if self.password_needs_rehash(user['password_hash']):
+            # 旧版哈希登录成功后顺便升级为当前算法和参数的哈希，同时更新最后登录时间
+            password_hash, salt = self.hash_password(password)
+            with self.get_connection() as conn:
+                conn.execute(
+                    "UPDATE users SET password_hash = ?, salt = ?, last_login = CURRENT_TIMESTAMP WHERE id = ?",
+                    (password_hash, salt, user['id'])
+                )
+        else:
+            # 最后登录时间只用于统计，延迟批量写入，登录本身不再产生写事务
+            self._schedule_last_login(user['id'])
+        
+        return {
+            'id': user['id'],
+            'username': user['username'],
+            'email': user['email'],
+            'flags': user['flags'],
+            'total_games': user['total_games'],
+            'wins': user['wins'],
+            'losses': user['losses'],
+        }
+    
+    def _schedule_last_login(self, user_id: int):
+        """登记待更新最后登录时间的用户，必要时启动定时写入"""
+        with self._last_login_lock:
+            self._pending_last_login.add(user_id)
+            if self._last_login_timer is None:
+                timer = threading.Timer(self.LAST_LOGIN_FLUSH_INTERVAL, self._on_last_login_timer)
+                timer.daemon = True
+                self._last_login_timer = timer
+                timer.start()
+    
+    def _on_last_login_timer(self):
+        """定时器回调：清除定时器标记并写入"""
+        with self._last_login_lock:
+            self._last_login_timer = None
+        self.flush_last_login()
+    
+    def flush_last_login(self):
+        """把登记的最后登录时间一次性写入数据库"""
+        with self._last_login_lock:
+            user_ids = self._pending_last_login
+            self._pending_last_login = set()
+        if not user_ids:
+            return
+        
+        try:
+            with self.transaction() as conn:
+                conn.executemany(_SQL_UPDATE_LAST_LOGIN, [(user_id,) for user_id in user_ids])
+        except sqlite3.Error as e:
+            print(f"写入最后登录时间错误: {e}")
     
     def create_session(self, user_id: int, expires_hours: int = 24) -> str:
         """创建用户会话
@@ -338,18 +685,45 @@ class Database:
         - 会话令牌具有足够的熵值，防止猜测攻击
         """
         session_token = secrets.token_urlsafe(32)  # 生成256位安全随机令牌
-        expires_at = datetime.now().timestamp() + (expires_hours * 3600)
+        expires_at = time.time() + (expires_hours * 3600)
         
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO user_sessions (user_id, session_token, expires_at) VALUES (?, ?, ?)",
-                (user_id, session_token, expires_at)
-            )
-            conn.commit()
+            conn.execute(_SQL_CREATE_SESSION, (user_id, session_token, expires_at))
+        
+        # 按概率顺带清理过期会话，使会话表规模与活跃会话数量保持同一量级
+        if random.random() < self.SESSION_PURGE_PROBABILITY:
+            self.purge_expired_sessions()
         
         return session_token
     
+    def purge_expired_sessions(self) -> int:
+        """删除所有已过期的会话
+        
+        过期会话不会被主动登出删除，长期运行时会在会话表中堆积。
+        该方法借助expires_at索引一次性删除它们。
+        
+        Returns:
+            int: 删除的会话数量
+        """
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                "DELETE FROM user_sessions WHERE expires_at <= ?", (time.time(),)
+            )
+            return cursor.rowcount
+    
+    def maintenance(self):
+        """定期维护数据库
+        
+        - PRAGMA optimize: 按需更新统计信息，表数据增长后查询计划不会退化
+        - PRAGMA wal_checkpoint(TRUNCATE): 把WAL内容写回主库并截断WAL文件，
+          避免请求过程中触发一次很大的检查点
+        
+        建议由服务器在空闲时定期调用（例如每天一次）。
+        """
+        with self.get_connection() as conn:
+            conn.execute("PRAGMA optimize")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    
     def verify_session(self, session_token: str) -> Optional[Dict[str, Any]]:
         """验证会话令牌
         
@@ -360,32 +734,39 @@ class Database:
             
         Returns:
             Optional[Dict[str, Any]]:
-            - 验证成功返回用户信息字典（包括用户基本信息和会话过期时间）
+            - 验证成功返回用户信息字典（id、username、email和会话过期时间expires_at）
             - 验证失败或已过期返回None
             
         验证逻辑：
         1. 在user_sessions表中查找匹配的会话令牌
         2. 检查会话是否未过期（expires_at > 当前时间戳）
-        3. 联接users表获取完整的用户信息
+        3. 联接users表获取用户基本信息（只取需要的列）
+        
+        验证成功的结果会在进程内缓存SESSION_CACHE_TTL秒（且不超过会话本身的过期时间），
+        短时间内重复校验同一令牌时不再访问数据库。
         """
+        now = time.time()
+        with self._session_cache_lock:
+            cached = self._session_cache.pop(session_token, None)
+            if cached is not None and now < cached[0]:
+                # 命中后重新插入到末尾，使淘汰顺序为最近最少使用（LRU）
+                self._session_cache[session_token] = cached
+                return dict(cached[1])
+        
         with self.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                """
-                SELECT u.*, s.expires_at 
-                FROM users u
-                JOIN user_sessions s ON u.id = s.user_id
-                WHERE s.session_token = ? AND s.expires_at > ?
-                """,
-                (session_token, datetime.now().timestamp())
-            )
-            result = cursor.fetchone()
-            
-            if result:
-                return dict(result)
+            result = conn.execute(_SQL_VERIFY_SESSION, (session_token, now)).fetchone()
+        
+        if not result:
             return None
+        
+        user = dict(result)
+        valid_until = min(user['expires_at'], now + self.SESSION_CACHE_TTL)
+        with self._session_cache_lock:
+            self._session_cache[session_token] = (valid_until, user)
+            # 超出容量时淘汰最久未使用的条目
+            while len(self._session_cache) > self.SESSION_CACHE_SIZE:
+                self._session_cache.pop(next(iter(self._session_cache)))
+        return dict(user)
     
     def invalidate_session(self, session_token: str) -> bool:
         """使会话令牌失效
@@ -398,13 +779,14 @@ class Database:
         Returns:
             bool: 操作是否成功（是否有令牌被删除）
         """
+        with self._session_cache_lock:
+            self._session_cache.pop(session_token, None)
+        
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
+            cursor = conn.execute(
                 "DELETE FROM user_sessions WHERE session_token = ?",
                 (session_token,)
             )
-            conn.commit()
             return cursor.rowcount > 0
     
     def get_user_stats(self, user_id: int) -> Dict[str, Any]:
@@ -424,45 +806,14 @@ class Database:
             - win_rate: 胜率百分比（小数点后两位）
             
         特性：
-        - 自动计算胜率，避免除零错误
-        - 使用字典的get方法提供默认值，防止数据不存在时的错误
+        - 胜率在SQL中直接计算，避免除零错误
         - 返回格式化的统计数据，便于前端显示
         """
         with self.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # 获取用户基本统计信息
-            cursor.execute(
-                """
-                SELECT 
-                    total_games, wins, losses, flags
-                FROM users WHERE id = ?
-                """,
-                (user_id,)
-            )
-            user = cursor.fetchone()
+            user = conn.execute(_SQL_USER_STATS, (user_id,)).fetchone()
             
             if user:
-                stats = dict(user)
-                # 确保所有字段都存在，如果不存在则使用默认值
-                total_games = stats.get('total_games', 0)
-                wins = stats.get('wins', 0)
-                losses = stats.get('losses', 0)
-                flags = stats.get('flags', 0)
-                
-                # 计算胜率（避免除零错误）
-                win_rate = 0
-                if total_games > 0:
-                    win_rate = round(wins * 100.0 / total_games, 2)
-                
-                return {
-                    'total_games': total_games,
-                    'wins': wins,
-                    'losses': losses,
-                    'flags': flags,
-                    'win_rate': win_rate
-                }
+                return dict(user)
             
             # 如果用户不存在，返回默认统计数据
             return {
@@ -473,6 +824,31 @@ class Database:
                 'win_rate': 0
             }
     
+    def get_stats_bulk(self, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """批量获取多个用户的统计信息
+        
+        用于排行榜等需要同时展示很多用户统计的场景，一次查询代替逐个调用get_user_stats。
+        用户ID列表以JSON数组作为单个参数传入，经json_each展开，
+        因此不受SQLite参数个数上限限制，且语句文本固定，可以命中语句缓存。
+        
+        Args:
+            user_ids (List[int]): 用户ID列表
+            
+        Returns:
+            Dict[int, Dict[str, Any]]: 用户ID到统计信息字典的映射，字段同get_user_stats；
+            不存在的用户不会出现在结果中
+        """
+        if not user_ids:
+            return {}
+        
+        with self.get_connection() as conn:
+            cursor = conn.execute(_SQL_USER_STATS_BULK, (json.dumps(list(user_ids)),))
+            result = {}
+            for row in cursor.fetchall():
+                stats = dict(row)
+                result[stats.pop('id')] = stats
+            return result
+    
     def update_user_stats(self, user_id: int, game_result: Dict[str, Any]):
         """更新用户游戏统计
         
@@ -486,36 +862,25 @@ class Database:
         流程：
         1. 总游戏数加1
         2. 根据游戏结果（胜负）相应增加wins或losses
-        3. 事务性操作，确保数据一致性
+        3. 两者合并为一条UPDATE语句，确保数据一致性
         
         注意：
         - 只更新胜负记录，不更新其他统计（如旗数量）
         - 使用原子操作保证数据一致性
         """
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # 更新总游戏数
-            cursor.execute(
-                "UPDATE users SET total_games = total_games + 1 WHERE id = ?",
-                (user_id,)
+            # 单条UPDATE同时更新总游戏数和胜负场次
+            won = 1 if game_result.get('won', False) else 0
+            conn.execute(
+                """
+                UPDATE users
+                SET total_games = total_games + 1,
+                    wins = wins + ?,
+                    losses = losses + ?
+                WHERE id = ?
+                """,
+                (won, 1 - won, user_id)
             )
-            
-            # 根据游戏结果更新统计
-            if game_result.get('won', False):
-                # 胜利，增加胜利场次
-                cursor.execute(
-                    "UPDATE users SET wins = wins + 1 WHERE id = ?",
-                    (user_id,)
-                )
-            else:
-                # 失败，增加失败场次
-                cursor.execute(
-                    "UPDATE users SET losses = losses + 1 WHERE id = ?",
-                    (user_id,)
-                )
-            
-            conn.commit()
     
     def record_game(self, room_id: str, winner_id: Optional[int], game_duration: int, total_turns: int) -> int:
         """记录游戏结果
@@ -537,15 +902,13 @@ class Database:
         - 便于游戏回放和分析
         """
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
+            cursor = conn.execute(
                 """
                 INSERT INTO games (room_id, winner_id, game_duration, total_turns, finished_at)
                 VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
                 """,
                 (room_id, winner_id, game_duration, total_turns)
             )
-            conn.commit()
             return cursor.lastrowid
     
     def record_game_player(self, game_id: int, user_id: int, final_rank: int, survived: bool):
@@ -564,25 +927,106 @@ class Database:
         - 支持个人游戏历史查看
         - 为成就系统提供数据支持
         """
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
+        self.record_game_players(game_id, [{
+            'user_id': user_id,
+            'final_rank': final_rank,
+            'survived': survived
+        }])
+    
+    def record_game_players(self, game_id: int, players: List[Dict[str, Any]]):
+        """批量记录游戏参与者信息
+        
+        一局游戏的所有参与者在同一个显式事务中用executemany一次写入，只提交一次。
+        
+        Args:
+            game_id (int): 游戏ID（来自games表）
+            players (List[Dict[str, Any]]): 参与者列表，每项包含：
+                - 'user_id': 用户ID
+                - 'final_rank': 最终排名（1为第一名）
+                - 'survived': 是否存活到最后
+        """
+        rows = [(game_id, p['user_id'], p['final_rank'], p['survived']) for p in players]
+        if not rows:
+            return
+        
+        with self.transaction() as conn:
+            conn.executemany(
                 """
                 INSERT INTO game_players (game_id, user_id, final_rank, survived)
                 VALUES (?, ?, ?, ?)
                 """,
-                (game_id, user_id, final_rank, survived)
+                rows
             )
-            conn.commit()
     
-    def get_available_music(self) -> Dict[str, List[str]]:
+    def finalize_match(self, room_id: str, winner_id: Optional[int], game_duration: int,
+                       total_turns: int, players: List[Dict[str, Any]], update_stats: bool = True) -> int:
+        """在一个事务中记录整局游戏的结果
+        
+        依次写入games表、批量写入game_players表，并（可选）更新参与者的胜负统计、
+        给胜利者发放1个旗作为奖励。所有写入只提交一次，避免每个玩家多次提交。
+        
+        Args:
+            room_id (str): 游戏房间ID
+            winner_id (Optional[int]): 获胜用户ID，可能为None（平局或未分胜负）
+            game_duration (int): 游戏持续时间（秒）
+            total_turns (int): 总回合数
+            players (List[Dict[str, Any]]): 参与者列表，每项包含：
+                - 'user_id': 用户ID
+                - 'final_rank': 最终排名（1为第一名）
+                - 'survived': 是否存活到最后
+                - 'won': 是否获胜
+            update_stats (bool): 是否更新胜负统计并发放胜利奖励，
+                只有游戏正常结束时才应为True
+            
+        Returns:
+            int: 创建的游戏记录ID
+        """
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO games (room_id, winner_id, game_duration, total_turns, finished_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """,
+                (room_id, winner_id, game_duration, total_turns)
+            )
+            game_id = cursor.lastrowid
+            
+            conn.executemany(
+                """
+                INSERT INTO game_players (game_id, user_id, final_rank, survived)
+                VALUES (?, ?, ?, ?)
+                """,
+                [(game_id, p['user_id'], p['final_rank'], p['survived']) for p in players]
+            )
+            
+            if update_stats:
+                conn.executemany(
+                    """
+                    UPDATE users
+                    SET total_games = total_games + 1,
+                        wins = wins + ?,
+                        losses = losses + ?
+                    WHERE id = ?
+                    """,
+                    [(1 if p['won'] else 0, 0 if p['won'] else 1, p['user_id']) for p in players]
+                )
+                
+                # 为胜利者增加一个"旗"作为奖励
+                conn.executemany(
+                    "UPDATE users SET flags = flags + 1 WHERE id = ?",
+                    [(p['user_id'],) for p in players if p['won']]
+                )
+            return game_id
+    
+    def get_available_music(self) -> Dict[str, Tuple[str, ...]]:
         """获取所有可用的音乐
         
         返回游戏中所有可用的背景音乐和胜利音乐列表。
-        目前使用硬编码列表，实际应用中可从文件系统动态获取。
+        目前使用模块级常量，实际应用中可从文件系统动态获取。
+        返回的是共享的常量字典，调用方不应修改。
         
         Returns:
-            Dict[str, List[str]]: 包含以下键的字典：
+            Dict[str, Tuple[str, ...]]: 包含以下键的字典：
             - 'bgm': 可用背景音乐列表
             - 'victory': 可用胜利音乐列表
             
@@ -598,33 +1042,7 @@ class Database:
         - mario-vict.mp3
         - weird-horn-vict.mp3
         """
-        try:
-            # 这里应该从文件系统获取实际的音乐文件列表
-            # 为了简化，我们返回硬编码的列表
-            bgm_list = [
-                'Whispers-of-Strategy.mp3',
-                'Electric-Heartbeat.mp3',
-                'Moonlight-and-Marmalade.mp3'
-            ]
-            
-            victory_list = [
-                'royal-vict.mp3',
-                'folk-vict.mp3',
-                'mario-vict.mp3',
-                'weird-horn-vict.mp3'
-            ]
-            
-            return {
-                'bgm': bgm_list,
-                'victory': victory_list
-            }
-        except Exception as e:
-            print(f"获取可用音乐错误: {e}")
-            # 出错时返回默认音乐列表
-            return {
-                'bgm': ['Whispers-of-Strategy.mp3'],
-                'victory': ['royal-vict.mp3']
-            }
+        return _AVAILABLE_MUSIC
     
     def get_user_game_history(self, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
         """获取用户游戏历史
@@ -654,26 +1072,11 @@ class Database:
         - 游戏统计和分析
         """
         with self.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                """
-                SELECT 
-                    g.id, g.room_id, g.winner_id, g.game_duration, g.total_turns, 
-                    g.created_at, g.finished_at,
-                    gp.final_rank, gp.survived,
-                    CASE WHEN g.winner_id = ? THEN 1 ELSE 0 END AS won
-                FROM games g
-                JOIN game_players gp ON g.id = gp.game_id
-                WHERE gp.user_id = ?
-                ORDER BY g.finished_at DESC
-                LIMIT ?
-                """,
-                (user_id, user_id, limit)
-            )
-            
-            return [dict(row) for row in cursor.fetchall()]
+            cursor = conn.execute(_SQL_USER_GAME_HISTORY, (user_id, user_id, limit))
+            # 按普通元组取行，列名只取一次，直接组装字典，省去中间的sqlite3.Row对象
+            cursor.row_factory = None
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
     
     def get_user_music_settings(self, user_id: int) -> Dict[str, Any]:
         """获取用户音乐设置
@@ -696,37 +1099,20 @@ class Database:
         """
         try:
             with self.get_connection() as conn:
-                cursor = conn.cursor()
+                # 一次查询取回选择和解锁的全部音乐，按来源和类型分桶
+                cursor = conn.execute(_SQL_USER_MUSIC_SETTINGS, (user_id,))
                 
-                # 获取用户选择的背景音乐
-                cursor.execute(
-                    "SELECT bgm_name FROM user_selected_bgm WHERE user_id = ?",
-                    (user_id,)
-                )
-                selected_bgm = cursor.fetchone()
-                selected_bgm = selected_bgm[0] if selected_bgm else 'Whispers-of-Strategy.mp3'
-                
-                # 获取用户选择的胜利音乐
-                cursor.execute(
-                    "SELECT victory_music_name FROM user_selected_victory_music WHERE user_id = ?",
-                    (user_id,)
-                )
-                selected_victory = cursor.fetchone()
-                selected_victory = selected_victory[0] if selected_victory else 'royal-vict.mp3'
-                
-                # 获取用户解锁的背景音乐
-                cursor.execute(
-                    "SELECT music_name FROM user_unlocked_bgm WHERE user_id = ?",
-                    (user_id,)
-                )
-                unlocked_bgm = [row[0] for row in cursor.fetchall()]
-                
-                # 获取用户解锁的胜利音乐
-                cursor.execute(
-                    "SELECT music_name FROM user_unlocked_victory_music WHERE user_id = ?",
-                    (user_id,)
-                )
-                unlocked_victory = [row[0] for row in cursor.fetchall()]
+                selected = dict(_DEFAULT_MUSIC)
+                unlocked = {'bgm': [], 'victory': []}
+                for is_selected, kind, music_names in cursor.fetchall():
+                    if is_selected:
+                        selected[kind] = music_names
+                    elif music_names:  # 该类型没有解锁任何音乐时为NULL
+                        unlocked[kind] = music_names.split(_MUSIC_SEPARATOR)
+                selected_bgm = selected['bgm']
+                selected_victory = selected['victory']
+                unlocked_bgm = unlocked['bgm']
+                unlocked_victory = unlocked['victory']
                 
                 return {
                     'selected_bgm': selected_bgm,
@@ -738,10 +1124,10 @@ class Database:
             print(f"获取用户音乐设置错误: {e}")
             # 出错时返回默认音乐设置
             return {
-                'selected_bgm': 'Whispers-of-Strategy.mp3',
-                'selected_victory': 'royal-vict.mp3',
-                'unlocked_bgm': ['Whispers-of-Strategy.mp3'],
-                'unlocked_victory': ['royal-vict.mp3']
+                'selected_bgm': _DEFAULT_MUSIC['bgm'],
+                'selected_victory': _DEFAULT_MUSIC['victory'],
+                'unlocked_bgm': [_DEFAULT_MUSIC['bgm']],
+                'unlocked_victory': [_DEFAULT_MUSIC['victory']]
             }
     
     def update_user_music_selection(self, user_id: int, bgm_name: str = None, victory_music_name: str = None) -> bool:
@@ -763,37 +1149,36 @@ class Database:
         - 会验证用户是否有权限选择该音乐（已解锁）
         """
         try:
-            with self.get_connection() as conn:
+            with self.transaction() as conn:
                 cursor = conn.cursor()
                 
                 # 更新背景音乐选择
                 if bgm_name:
                     cursor.execute(
-                        "INSERT OR REPLACE INTO user_selected_bgm (user_id, bgm_name) VALUES (?, ?)",
+                        "INSERT OR REPLACE INTO user_selected_music (user_id, kind, music_name) VALUES (?, 'bgm', ?)",
                         (user_id, bgm_name)
                     )
                 
                 # 更新胜利音乐选择
                 if victory_music_name:
                     cursor.execute(
-                        "INSERT OR REPLACE INTO user_selected_victory_music (user_id, victory_music_name) VALUES (?, ?)",
+                        "INSERT OR REPLACE INTO user_selected_music (user_id, kind, music_name) VALUES (?, 'victory', ?)",
                         (user_id, victory_music_name)
                     )
-                
-                conn.commit()
                 return True
         except Exception as e:
             print(f"更新用户音乐选择错误: {e}")
             return False
     
-    def unlock_bgm(self, user_id: int, music_name: str) -> bool:
-        """解锁背景音乐
+    def unlock_music(self, user_id: int, kind: str, music_name: str) -> bool:
+        """解锁音乐
         
-        为指定用户解锁指定的背景音乐，使其可以选择使用。
+        为指定用户解锁指定的音乐，使其可以选择使用。
         
         Args:
             user_id (int): 用户ID
-            music_name (str): 要解锁的背景音乐文件名
+            kind (str): 音乐类型，'bgm' 或 'victory'
+            music_name (str): 要解锁的音乐文件名
             
         Returns:
             bool: 解锁是否成功
@@ -804,113 +1189,123 @@ class Database:
         """
         try:
             with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT OR IGNORE INTO user_unlocked_bgm (user_id, music_name) VALUES (?, ?)",
-                    (user_id, music_name)
-                )
-                conn.commit()
+                cursor = conn.execute(_SQL_UNLOCK_MUSIC, (user_id, kind, music_name))
                 return cursor.rowcount > 0
         except sqlite3.Error:
             return False
+        finally:
+            self._invalidate_unlocked_cache(user_id, kind)
+    
+    def unlock_bgm(self, user_id: int, music_name: str) -> bool:
+        """解锁背景音乐，参见 unlock_music"""
+        return self.unlock_music(user_id, 'bgm', music_name)
     
     def unlock_victory_music(self, user_id: int, music_name: str) -> bool:
-        """解锁胜利音乐
+        """解锁胜利音乐，参见 unlock_music"""
+        return self.unlock_music(user_id, 'victory', music_name)
+    
+    def unlock_and_select_music(self, user_id: int, kind: str, music_name: str) -> bool:
+        """解锁音乐并立即设为当前选择
         
-        为指定用户解锁指定的胜利音乐，使其可以选择使用。
+        "解锁后装备"的流程在同一个写事务中完成，
+        代替先调用unlock_music再调用update_user_music_selection的两次提交。
         
         Args:
             user_id (int): 用户ID
-            music_name (str): 要解锁的胜利音乐文件名
-            
+            kind (str): 音乐类型，'bgm' 或 'victory'
+            music_name (str): 音乐文件名
+        
         Returns:
-            bool: 解锁是否成功
-            
-        特性：
-        - 使用INSERT OR IGNORE避免重复解锁错误
-        - 只有真正解锁了新音乐时才返回True
+            bool: 操作是否成功（音乐此前已解锁时也会完成选择并返回True）
         """
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT OR IGNORE INTO user_unlocked_victory_music (user_id, music_name) VALUES (?, ?)",
-                    (user_id, music_name)
+            with self.transaction() as conn:
+                conn.execute(_SQL_UNLOCK_MUSIC, (user_id, kind, music_name))
+                conn.execute(
+                    "INSERT OR REPLACE INTO user_selected_music (user_id, kind, music_name) VALUES (?, ?, ?)",
+                    (user_id, kind, music_name)
                 )
-                conn.commit()
-                return cursor.rowcount > 0
+                return True
         except sqlite3.Error:
             return False
+        finally:
+            self._invalidate_unlocked_cache(user_id, kind)
     
-    def get_unlocked_bgm(self, user_id: int) -> List[str]:
-        """获取用户已解锁的背景音乐列表
+    def get_unlocked_music(self, user_id: int, kind: str) -> List[str]:
+        """获取用户已解锁的音乐列表
         
         Args:
             user_id (int): 用户ID
+            kind (str): 音乐类型，'bgm' 或 'victory'
             
         Returns:
-            List[str]: 已解锁的背景音乐文件名列表
+            List[str]: 已解锁的音乐文件名列表
         """
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT music_name FROM user_unlocked_bgm WHERE user_id = ?",
-                (user_id,)
-            )
-            return [row[0] for row in cursor.fetchall()]
+            music_names = conn.execute(_SQL_UNLOCKED_MUSIC, (user_id, kind)).fetchone()[0]
+        return music_names.split(_MUSIC_SEPARATOR) if music_names else []
+    
+    def get_unlocked_bgm(self, user_id: int) -> List[str]:
+        """获取用户已解锁的背景音乐列表"""
+        return self.get_unlocked_music(user_id, 'bgm')
     
     def get_unlocked_victory_music(self, user_id: int) -> List[str]:
-        """获取用户已解锁的胜利音乐列表
+        """获取用户已解锁的胜利音乐列表"""
+        return self.get_unlocked_music(user_id, 'victory')
+    
+    def _get_unlocked_set(self, user_id: int, kind: str) -> frozenset:
+        """获取用户已解锁音乐的集合（带短期进程内缓存）
+        
+        打开音乐菜单时会对每首音乐逐一检查解锁状态，缓存后只需一次查询。
         
         Args:
             user_id (int): 用户ID
+            kind (str): 音乐类型，'bgm' 或 'victory'
             
         Returns:
-            List[str]: 已解锁的胜利音乐文件名列表
+            frozenset: 已解锁的音乐文件名集合
         """
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT music_name FROM user_unlocked_victory_music WHERE user_id = ?",
-                (user_id,)
-            )
-            return [row[0] for row in cursor.fetchall()]
+        key = (user_id, kind)
+        now = time.time()
+        with self._unlocked_cache_lock:
+            cached = self._unlocked_cache.get(key)
+        if cached is not None and now < cached[0]:
+            return cached[1]
+        
+        names = frozenset(self.get_unlocked_music(user_id, kind))
+        
+        with self._unlocked_cache_lock:
+            self._unlocked_cache.pop(key, None)
+            self._unlocked_cache[key] = (now + self.UNLOCKED_CACHE_TTL, names)
+            while len(self._unlocked_cache) > self.UNLOCKED_CACHE_SIZE:
+                self._unlocked_cache.pop(next(iter(self._unlocked_cache)))
+        return names
     
-    def is_bgm_unlocked(self, user_id: int, music_name: str) -> bool:
-        """检查背景音乐是否已解锁
+    def _invalidate_unlocked_cache(self, user_id: int, kind: str):
+        """解锁新音乐后使对应的缓存失效"""
+        with self._unlocked_cache_lock:
+            self._unlocked_cache.pop((user_id, kind), None)
+    
+    def is_music_unlocked(self, user_id: int, kind: str, music_name: str) -> bool:
+        """检查音乐是否已解锁
         
         Args:
             user_id (int): 用户ID
+            kind (str): 音乐类型，'bgm' 或 'victory'
             music_name (str): 音乐文件名
             
         Returns:
             bool: 是否已解锁
         """
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT 1 FROM user_unlocked_bgm WHERE user_id = ? AND music_name = ?",
-                (user_id, music_name)
-            )
-            return cursor.fetchone() is not None
+        return music_name in self._get_unlocked_set(user_id, kind)
+    
+    def is_bgm_unlocked(self, user_id: int, music_name: str) -> bool:
+        """检查背景音乐是否已解锁"""
+        return self.is_music_unlocked(user_id, 'bgm', music_name)
     
     def is_victory_music_unlocked(self, user_id: int, music_name: str) -> bool:
-        """检查胜利音乐是否已解锁
-        
-        Args:
-            user_id (int): 用户ID
-            music_name (str): 音乐文件名
-            
-        Returns:
-            bool: 是否已解锁
-        """
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT music_name FROM user_unlocked_victory_music WHERE user_id = ? AND music_name = ?",
-                (user_id, music_name)
-            )
-            return cursor.fetchone() is not None
+        """检查胜利音乐是否已解锁"""
+        return self.is_music_unlocked(user_id, 'victory', music_name)
     
     def get_user_flags(self, user_id: int) -> int:
         """获取用户货币（旗）数量
@@ -922,9 +1317,7 @@ class Database:
             int: 用户当前拥有的旗数量，如果用户不存在返回0
         """
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT flags FROM users WHERE id = ?", (user_id,))
-            result = cursor.fetchone()
+            result = conn.execute(_SQL_GET_USER_FLAGS, (user_id,)).fetchone()
             return result[0] if result else 0
     
     def add_user_flags(self, user_id: int, flags: int) -> bool:
@@ -946,12 +1339,7 @@ class Database:
         
         try:
             with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE users SET flags = flags + ? WHERE id = ?",
-                    (flags, user_id)
-                )
-                conn.commit()
+                cursor = conn.execute(_SQL_ADD_USER_FLAGS, (flags, user_id))
                 return cursor.rowcount > 0
         except sqlite3.Error:
             return False
@@ -959,7 +1347,7 @@ class Database:
     def spend_user_flags(self, user_id: int, flags: int) -> bool:
         """花费用户货币（旗）数量
         
-        扣除用户的旗数量，先检查余额是否充足。
+        扣除用户的旗数量，余额检查和扣除在同一条UPDATE语句中完成。
         
         Args:
             user_id (int): 用户ID
@@ -970,27 +1358,15 @@ class Database:
             
         安全检查：
         - 验证flags参数为正数
-        - 先检查余额，余额不足时拒绝操作
-        - 使用事务操作确保数据一致性
+        - 余额不足时UPDATE不匹配任何行，拒绝操作
+        - 单条语句原子执行，不存在先查询后扣除的竞态
         """
         if flags <= 0:
             return False
         
         try:
             with self.get_connection() as conn:
-                cursor = conn.cursor()
-                # 检查用户是否有足够的旗
-                cursor.execute("SELECT flags FROM users WHERE id = ?", (user_id,))
-                result = cursor.fetchone()
-                if not result or result[0] < flags:
-                    return False
-                
-                # 扣除旗
-                cursor.execute(
-                    "UPDATE users SET flags = flags - ? WHERE id = ?",
-                    (flags, user_id)
-                )
-                conn.commit()
+                cursor = conn.execute(_SQL_SPEND_USER_FLAGS, (flags, user_id, flags))
                 return cursor.rowcount > 0
         except sqlite3.Error:
             return False
@@ -1008,12 +1384,10 @@ class Database:
         """
         try:
             with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
+                return conn.execute(
                     "SELECT 1 FROM users WHERE username = ?",
                     (username,)
-                )
-                return cursor.fetchone() is not None
+                ).fetchone() is not None
         except sqlite3.Error:
             return False
 
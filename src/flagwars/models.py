@@ -14,8 +14,9 @@
 版本: 1.0.0
 """
 
+from collections import deque
 from enum import Enum
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 import random # 确保导入random
 
 
@@ -51,6 +52,40 @@ class TerrainType(Enum):
     SWAMP = "swamp"  # 沼泽
 
 
+# 地形成员的模块级别名：热路径上用 `is` 比较，避免每次都经过枚举类的属性查找
+_PLAIN = TerrainType.PLAIN
+_BASE = TerrainType.BASE
+_TOWER = TerrainType.TOWER
+_WALL = TerrainType.WALL
+_MOUNTAIN = TerrainType.MOUNTAIN
+_SWAMP = TerrainType.SWAMP
+
+# 上下左右四个方向，模块级常量避免每次调用都重建列表
+_DIRECTIONS = ((0, 1), (0, -1), (1, 0), (-1, 0))
+
+# 各地形占领所需士兵数量（塔楼为随机值，见 Tile._get_required_soldiers）
+_REQUIRED_SOLDIERS: Dict[TerrainType, int] = {
+    _PLAIN: 0,
+    _BASE: 10,
+    _WALL: 3,
+    _MOUNTAIN: 9999,
+    _SWAMP: 0,
+}
+_TOWER_MIN_SOLDIERS = 5
+_TOWER_MAX_SOLDIERS = 20
+
+# 玩家视野范围（曼哈顿距离）：拥有的地块周围该距离内均可见
+_VISION_RANGE = 2
+
+# 随机地形的生成顺序：(地形, 数量, 距地图边缘的最小距离, 是否驻守与占领所需数量相同的士兵)
+_TERRAIN_PLACEMENT = (
+    (_TOWER, 8, 2, True),      # 塔楼
+    (_WALL, 10, 1, True),      # 城墙
+    (_MOUNTAIN, 12, 1, False), # 山脉
+    (_SWAMP, 6, 1, False),     # 沼泽
+)
+
+
 class Player:
     """
     玩家数据模型类
@@ -190,40 +225,54 @@ class Player:
 
 class Tile:
     """地图格子类"""
-    def __init__(self, x: int, y: int, terrain_type: TerrainType):
+    def __init__(self, x: int, y: int, terrain_type: TerrainType,
+                 owned_by: Optional[Dict[int, Set['Tile']]] = None):
         self.x = x
         self.y = y
         self.terrain_type = terrain_type
-        self.owner: Optional[Player] = None
+        # 所属GameState的玩家地块索引 {player_id: {Tile}}，所有者变化时同步更新
+        self._owned_by = owned_by
+        self._owner: Optional[Player] = None
         self.soldiers: int = 0
         self.required_soldiers = self._get_required_soldiers()
-        # 战争迷雾：记录每个玩家是否可见此地块 {player_id: bool}
-        self.visibility: Dict[int, bool] = {}
+        # 战争迷雾：可见性位图，第i位为1表示占用第i个可见性槽位的玩家可见此地块
+        # （玩家与槽位的对应关系见 GameState.visibility_masks）
+        self.visibility_bits: int = 0
+    
+    @property
+    def owner(self) -> Optional[Player]:
+        """地块所有者"""
+        return self._owner
+    
+    @owner.setter
+    def owner(self, player: Optional[Player]) -> None:
+        """设置地块所有者，并同步更新玩家地块索引"""
+        old_owner = self._owner
+        if old_owner is player:
+            return
+        index = self._owned_by
+        if index is not None:
+            if old_owner is not None and old_owner.id in index:
+                index[old_owner.id].discard(self)
+            if player is not None:
+                index.setdefault(player.id, set()).add(self)
+        self._owner = player
     
     def _get_required_soldiers(self) -> int:
         """获取占领所需士兵数量"""
-        if self.terrain_type == TerrainType.PLAIN:
-            return 0
-        elif self.terrain_type == TerrainType.BASE:
-            return 10
-        elif self.terrain_type == TerrainType.TOWER:
-            import random
-            return random.randint(5, 20)
-        elif self.terrain_type == TerrainType.WALL:
-            return 3
-        elif self.terrain_type == TerrainType.MOUNTAIN:
-            return 9999
-        elif self.terrain_type == TerrainType.SWAMP:
-            return 0
-        return 0
+        terrain_type = self.terrain_type
+        if terrain_type is _TOWER:
+            # 塔楼的守军数量随机
+            return random.randint(_TOWER_MIN_SOLDIERS, _TOWER_MAX_SOLDIERS)
+        return _REQUIRED_SOLDIERS.get(terrain_type, 0)
     
     def is_passable(self) -> bool:
         """判断是否可通行"""
-        return self.terrain_type not in [TerrainType.MOUNTAIN]
+        return self.terrain_type is not _MOUNTAIN
     
     def can_be_captured(self) -> bool:
         """判断是否可被占领"""
-        return self.terrain_type not in [TerrainType.MOUNTAIN]
+        return self.terrain_type is not _MOUNTAIN
 
 
 class GameState:
@@ -233,12 +282,18 @@ class GameState:
         self.map_width = 20
         self.map_height = 20
         self.tiles = []
+        # 按行优先顺序展开的地块元组，tiles_flat[y * map_width + x] 即 tiles[y][x]
+        self.tiles_flat: Tuple[Tile, ...] = ()
         self.players = {}
+        # 玩家地块索引 {player_id: {Tile}}，避免每次查找玩家地块都扫描整张地图
+        self.owned_by: Dict[int, Set[Tile]] = {}
+        # 玩家可见性掩码 {player_id: 1 << slot}，与 Tile.visibility_bits 按位对应
+        self.visibility_masks: Dict[int, int] = {}
         self.current_tick = 0
         self.game_over = False
         self.game_started = False
         self.winner = None
-        self.pending_moves = {}
+        self.pending_moves = {}  # {player_id: deque([move_data, ...])}，按先进先出顺序执行
         self.spawn_points = []
         self.game_over_type = None
         
@@ -254,8 +309,10 @@ class GameState:
         for y in range(self.map_height):
             row = []
             for x in range(self.map_width):
-                row.append(Tile(x, y, TerrainType.PLAIN))
+                row.append(Tile(x, y, TerrainType.PLAIN, self.owned_by))
             self.tiles.append(row)
+        self.tiles_flat = tuple(tile for row in self.tiles for tile in row)
+        self.vision_cells = self._build_vision_cells(_VISION_RANGE)
         
         # 随机生成地形
         self._generate_random_terrain()
@@ -265,76 +322,52 @@ class GameState:
     
     def _initialize_fog_of_war(self):
         """初始化战争迷雾：默认所有地块对所有玩家都不可见"""
-        for row in self.tiles:
-            for tile in row:
-                # 初始化每个地块的可见性为空字典，稍后根据实际玩家进行填充
-                tile.visibility = {}
+        for tile in self.tiles_flat:
+            # 清空每个地块的可见性位图，稍后根据实际玩家进行填充
+            tile.visibility_bits = 0
+    
+    def _get_visibility_mask(self, player_id: int) -> int:
+        """获取玩家的可见性掩码，首次调用时为其分配一个新的槽位"""
+        mask = self.visibility_masks.get(player_id)
+        if mask is None:
+            mask = 1 << len(self.visibility_masks)
+            self.visibility_masks[player_id] = mask
+        return mask
     
     def _initialize_player_visibility(self, player_id: int):
         """为指定玩家在所有地块上初始化可见性（默认为不可见）"""
-        for row in self.tiles:
-            for tile in row:
-                tile.visibility[player_id] = False
+        clear_mask = ~self._get_visibility_mask(player_id)
+        for tile in self.tiles_flat:
+            tile.visibility_bits &= clear_mask
     
     def _initialize_spectator_visibility(self, player_id: int):
         """为指定观战者在所有地块上初始化可见性（观战者拥有全图视野）"""
-        for row in self.tiles:
-            for tile in row:
-                tile.visibility[player_id] = True
+        mask = self._get_visibility_mask(player_id)
+        for tile in self.tiles_flat:
+            tile.visibility_bits |= mask
     
     def _generate_random_terrain(self):
-        """随机生成地形"""
-        import random
+        """随机生成地形
         
-        # 生成一些塔楼
-        towers_placed = 0
-        max_attempts = 100
-        while towers_placed < 8 and max_attempts > 0:
-            max_attempts -= 1
-            x = random.randint(2, self.map_width - 3)
-            y = random.randint(2, self.map_height - 3)
-            if self.tiles[y][x].terrain_type == TerrainType.PLAIN:
-                self.tiles[y][x].terrain_type = TerrainType.TOWER
-                self.tiles[y][x].required_soldiers = self.tiles[y][x]._get_required_soldiers()
-                self.tiles[y][x].soldiers = self.tiles[y][x].required_soldiers
-                towers_placed += 1
-        
-        # 生成一些城墙
-        walls_placed = 0
-        max_attempts = 100
-        while walls_placed < 10 and max_attempts > 0:
-            max_attempts -= 1
-            x = random.randint(1, self.map_width - 2)
-            y = random.randint(1, self.map_height - 2)
-            if self.tiles[y][x].terrain_type == TerrainType.PLAIN:
-                self.tiles[y][x].terrain_type = TerrainType.WALL
-                self.tiles[y][x].required_soldiers = self.tiles[y][x]._get_required_soldiers()
-                self.tiles[y][x].soldiers = self.tiles[y][x].required_soldiers
-                walls_placed += 1
-        
-        # 生成一些山脉
-        mountains_placed = 0
-        max_attempts = 100
-        while mountains_placed < 12 and max_attempts > 0:
-            max_attempts -= 1
-            x = random.randint(1, self.map_width - 2)
-            y = random.randint(1, self.map_height - 2)
-            if self.tiles[y][x].terrain_type == TerrainType.PLAIN:
-                self.tiles[y][x].terrain_type = TerrainType.MOUNTAIN
-                self.tiles[y][x].required_soldiers = self.tiles[y][x]._get_required_soldiers()
-                mountains_placed += 1
-        
-        # 生成一些沼泽
-        swamps_placed = 0
-        max_attempts = 100
-        while swamps_placed < 6 and max_attempts > 0:
-            max_attempts -= 1
-            x = random.randint(1, self.map_width - 2)
-            y = random.randint(1, self.map_height - 2)
-            if self.tiles[y][x].terrain_type == TerrainType.PLAIN:
-                self.tiles[y][x].terrain_type = TerrainType.SWAMP
-                self.tiles[y][x].required_soldiers = self.tiles[y][x]._get_required_soldiers()
-                swamps_placed += 1
+        每种地形从当前仍为平原的候选地块中一次性无放回抽样，
+        不再逐次随机坐标再检查是否为平原。
+        """
+        width = self.map_width
+        height = self.map_height
+        tiles = self.tiles_flat
+        for terrain_type, count, margin, garrisoned in _TERRAIN_PLACEMENT:
+            # 按行优先顺序遍历扁平地块元组，与逐行逐列遍历的候选顺序相同
+            candidates = [
+                tile for tile in tiles
+                if tile.terrain_type is _PLAIN
+                and margin <= tile.x < width - margin
+                and margin <= tile.y < height - margin
+            ]
+            for tile in random.sample(candidates, min(count, len(candidates))):
+                tile.terrain_type = terrain_type
+                tile.required_soldiers = tile._get_required_soldiers()
+                if garrisoned:
+                    tile.soldiers = tile.required_soldiers
     
     def generate_random_spawn_points(self, num_players: int, min_distance: int = None) -> List[Tuple[int, int]]:
         """
@@ -352,14 +385,10 @@ class GameState:
             min_distance = max(3, int(map_diagonal / (2 * (num_players ** 0.5))))
         
         spawn_points = []
-        candidates = []
         min_distance_from_edge = 2
         
         # 1. 收集所有合法的候选位置
-        for y in range(min_distance_from_edge, self.map_height - min_distance_from_edge):
-            for x in range(min_distance_from_edge, self.map_width - min_distance_from_edge):
-                if self._is_safe_spawn_location(x, y):
-                    candidates.append((x, y))
+        candidates = self._find_safe_spawn_locations(min_distance_from_edge)
         
         if not candidates:
             # 极端情况：没有候选点，回退到纯随机
@@ -373,41 +402,37 @@ class GameState:
 
         # 2. 随机选择第一个出生点
         first_spawn = random.choice(candidates)
+        first_x, first_y = first_spawn
         spawn_points.append(first_spawn)
         # 从候选列表中移除已选点
         candidates.remove(first_spawn)
         
+        # 每个候选点到已选出生点的最近曼哈顿距离，与candidates一一对应；
+        # 每选出一个出生点后只需和新点比较一次，无需对所有出生点重新计算
+        min_dists = [abs(x - first_x) + abs(y - first_y) for x, y in candidates]
+        
+        def take_candidate(index: int):
+            """选中指定下标的候选点作为出生点，并更新其余候选点的最近距离"""
+            spawn_x, spawn_y = candidates.pop(index)
+            del min_dists[index]
+            spawn_points.append((spawn_x, spawn_y))
+            for i, (x, y) in enumerate(candidates):
+                dist = abs(x - spawn_x) + abs(y - spawn_y)
+                if dist < min_dists[i]:
+                    min_dists[i] = dist
+        
         # 3. 为剩余玩家寻找最佳位置（满足最小距离要求）
         attempts_without_improvement = 0
         max_attempts = 1000
         
         while len(spawn_points) < num_players and candidates and attempts_without_improvement < max_attempts:
             max_attempts -= 1
-            best_candidate = None
-            max_min_distance = -1
-            
-            for cand in candidates:
-                cand_x, cand_y = cand
-                
-                # 检查是否满足最小距离要求
-                min_dist_to_existing = float('inf')
-                for sp_x, sp_y in spawn_points:
-                    # 使用曼哈顿距离
-                    dist = abs(cand_x - sp_x) + abs(cand_y - sp_y)
-                    if dist < min_dist_to_existing:
-                        min_dist_to_existing = dist
-                
-                # 只有当满足最小距离要求时才考虑这个候选点
-                if min_dist_to_existing >= min_distance:
-                    # 在满足最小距离的点中，选择距离现有出生点最远的
-                    if min_dist_to_existing > max_min_distance:
-                        max_min_distance = min_dist_to_existing
-                        best_candidate = cand
+            # "最近距离"最大的候选点（相同时取靠前的）
+            best = max(range(len(candidates)), key=min_dists.__getitem__)
             
-            # 如果找到了满足最小距离要求的候选点
-            if best_candidate:
-                spawn_points.append(best_candidate)
-                candidates.remove(best_candidate)
+            # 只有当满足最小距离要求时才选择这个候选点
+            if min_dists[best] >= min_distance:
+                take_candidate(best)
                 attempts_without_improvement = 0
             else:
                 # 没有找到满足最小距离要求的点，尝试放宽要求
@@ -417,78 +442,73 @@ class GameState:
                     attempts_without_improvement = 0
                     print(f"Warning: Reducing min_distance to {min_distance} to find valid spawn points")
         
-        # 如果仍然找不到足够的满足条件的点，回退到原有算法
+        # 如果仍然找不到足够的满足条件的点，回退为不限最小距离，直接选"最近距离"最大的候选点
         while len(spawn_points) < num_players and candidates:
-            best_candidate = None
-            max_min_distance = -1
-            
-            for cand in candidates:
-                cand_x, cand_y = cand
-                
-                # 计算该候选点到所有已存在出生点的最近距离
-                min_dist_to_existing = float('inf')
-                for sp_x, sp_y in spawn_points:
-                    # 使用曼哈顿距离
-                    dist = abs(cand_x - sp_x) + abs(cand_y - sp_y)
-                    if dist < min_dist_to_existing:
-                        min_dist_to_existing = dist
-                
-                # 记录"最近距离"最大的那个候选点
-                if min_dist_to_existing > max_min_distance:
-                    max_min_distance = min_dist_to_existing
-                    best_candidate = cand
-            
-            if best_candidate:
-                spawn_points.append(best_candidate)
-                candidates.remove(best_candidate)
-            else:
-                break
+            take_candidate(max(range(len(candidates)), key=min_dists.__getitem__))
         
         # 随机打乱出生点分配顺序，避免第一个生成的点总是被特定玩家占据
         random.shuffle(spawn_points)
         
         return spawn_points
 
-    def _is_safe_spawn_location(self, x: int, y: int) -> bool:
-        """检查指定位置的地形和周围环境是否适合作为出生点"""
-        # 1. 检查本身地形
-        if self.tiles[y][x].terrain_type != TerrainType.PLAIN:
-            return False
+    def _find_safe_spawn_locations(self, margin: int) -> List[Tuple[int, int]]:
+        """找出距地图边缘至少margin格、地形和周围环境适合作为出生点的所有位置
+        
+        判断条件：
+        1. 本身是平原
+        2. 周围2格范围（5x5，不含中心）内的山脉不超过一半（防止出生即被困）
+        3. 紧邻的十字方向至少有2个通路
         
-        # 2. 检查周围是否有太多障碍物 (防止出生即被困)
-        obstacle_count = 0
+        山脉数量用二维前缀和（积分图）计算，每个位置的5x5统计只需常数次查表。
+        """
+        width = self.map_width
+        height = self.map_height
+        tiles = self.tiles
         check_radius = 2  # 检查周围2格的范围
-        total_neighbors = 0
         
-        for dy in range(-check_radius, check_radius + 1):
-            for dx in range(-check_radius, check_radius + 1):
-                # 跳过中心点
-                if dx == 0 and dy == 0:
+        # prefix[y][x] 为 [0, y) x [0, x) 矩形内的山脉数量
+        prefix = [[0] * (width + 1) for _ in range(height + 1)]
+        for y in range(height):
+            row = tiles[y]
+            above = prefix[y]
+            current = prefix[y + 1]
+            row_count = 0
+            for x in range(width):
+                if row[x].terrain_type is _MOUNTAIN:
+                    row_count += 1
+                current[x + 1] = above[x + 1] + row_count
+        
+        locations = []
+        for y in range(margin, height - margin):
+            y0 = max(0, y - check_radius)
+            y1 = min(height, y + check_radius + 1)
+            top = prefix[y0]
+            bottom = prefix[y1]
+            for x in range(margin, width - margin):
+                # 1. 检查本身地形
+                if tiles[y][x].terrain_type is not _PLAIN:
                     continue
-                    
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < self.map_width and 0 <= ny < self.map_height:
-                    total_neighbors += 1
-                    # 山脉视为绝对障碍
-                    if self.tiles[ny][nx].terrain_type == TerrainType.MOUNTAIN:
-                        obstacle_count += 1
-        
-        # 如果周围超过一半是障碍物，或者紧邻的上下左右有2个以上障碍物，则不安全
-        if obstacle_count > (total_neighbors // 2): 
-            return False
-            
-        # 额外检查：确保紧邻的十字方向至少有2个通路
-        adj_passable = 0
-        for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
-            nx, ny = x + dx, y + dy
-            if 0 <= nx < self.map_width and 0 <= ny < self.map_height:
-                if self.tiles[ny][nx].is_passable():
-                    adj_passable += 1
-        
-        if adj_passable < 2: # 至少有两个方向可以走
-            return False
-        
-        return True
+                
+                # 2. 中心是平原，窗口内的山脉数量即周围障碍物数量
+                x0 = max(0, x - check_radius)
+                x1 = min(width, x + check_radius + 1)
+                obstacle_count = bottom[x1] - bottom[x0] - top[x1] + top[x0]
+                total_neighbors = (x1 - x0) * (y1 - y0) - 1
+                if obstacle_count > (total_neighbors // 2):
+                    continue
+                
+                # 3. 确保紧邻的十字方向至少有2个通路
+                adj_passable = 0
+                for dx, dy in _DIRECTIONS:
+                    nx, ny = x + dx, y + dy
+                    if 0 <= nx < width and 0 <= ny < height:
+                        if tiles[ny][nx].terrain_type is not _MOUNTAIN:
+                            adj_passable += 1
+                if adj_passable < 2:  # 至少有两个方向可以走
+                    continue
+                
+                locations.append((x, y))
+        return locations
     
     def add_player(self, player: Player, base_x: int, base_y: int):
         """添加玩家并设置基地"""
@@ -496,7 +516,7 @@ class GameState:
         player.base_position = (base_x, base_y)
         
         # 为新玩家初始化操作队列
-        self.pending_moves[player.id] = []
+        self.pending_moves[player.id] = deque()
         
         # 为新玩家在所有地块上初始化可见性（默认为不可见）
         self._initialize_player_visibility(player.id)
@@ -514,7 +534,7 @@ class GameState:
         player.base_position = None  # 观战者没有基地位置
         
         # 为观战者初始化操作队列（虽然他们不会使用）
-        self.pending_moves[player.id] = []
+        self.pending_moves[player.id] = deque()
         
         # 为观战者在所有地块上初始化可见性（观战者拥有全图视野）
         self._initialize_spectator_visibility(player.id)
@@ -527,18 +547,17 @@ class GameState:
             #player = self.players[player_id]
             
             # 将玩家拥有的所有地块变为中立，但保留兵力
-            for row in self.tiles:
-                for tile in row:
-                    if tile.owner and tile.owner.id == player_id:
-                        # 保留兵力，但将所有者设为None，变为中立
-                        tile.owner = None
-                        # 基地变为普通平原
-                        if tile.terrain_type == TerrainType.BASE:
-                            tile.terrain_type = TerrainType.PLAIN
-                            tile.required_soldiers = 0
+            for tile in list(self.owned_by.get(player_id, ())):
+                # 保留兵力，但将所有者设为None，变为中立
+                tile.owner = None
+                # 基地变为普通平原
+                if tile.terrain_type is _BASE:
+                    tile.terrain_type = TerrainType.PLAIN
+                    tile.required_soldiers = 0
             
-            # 从玩家字典中删除
+            # 从玩家字典和地块索引中删除
             del self.players[player_id]
+            self.owned_by.pop(player_id, None)
     
     def update(self):
         """更新游戏状态（供服务器调用）"""
@@ -569,7 +588,7 @@ class GameState:
             # 如果该玩家有待处理的操作
             if moves:
                 # 取出第一个操作并执行
-                move_data = moves.pop(0)
+                move_data = moves.popleft()
                 
                 # 使用相同的逻辑生成move_id（在move_soldiers中使用的逻辑）
                 move_id = f"{player_id}_{move_data['from_x']}_{move_data['from_y']}_{move_data['to_x']}_{move_data['to_y']}_{move_data.get('created_tick', self.current_tick)}"
@@ -609,8 +628,8 @@ class GameState:
         if not (0 <= to_x < self.map_width and 0 <= to_y < self.map_height):
             return False
         
-        from_tile = self.tiles[from_y][from_x]
-        to_tile = self.tiles[to_y][to_x]
+        from_tile = self.tiles_flat[from_y * self.map_width + from_x]
+        to_tile = self.tiles_flat[to_y * self.map_width + to_x]
         
         # 检查玩家所有权和可通行性
         if from_tile.owner is None or from_tile.owner.id != player_id:
@@ -625,7 +644,7 @@ class GameState:
         # 检查是否是敌方基地，如果是，记录原始所有者
         is_enemy_base = False
         base_owner = None
-        if to_tile.terrain_type == TerrainType.BASE and to_tile.owner is not None and to_tile.owner.id != player_id:
+        if to_tile.terrain_type is _BASE and to_tile.owner is not None and to_tile.owner.id != player_id:
             is_enemy_base = True
             for player in self.players.values():
                 if player.base_position == (to_x, to_y):
@@ -647,7 +666,7 @@ class GameState:
                     to_tile.owner = from_tile.owner
                     to_tile.soldiers = movable_soldiers
                     # 如果是墙，被占领后变为平原
-                    if to_tile.terrain_type == TerrainType.WALL:
+                    if to_tile.terrain_type is _WALL:
                         to_tile.terrain_type = TerrainType.PLAIN
                         to_tile.required_soldiers = 0  # 平原无需士兵即可占领
                 elif movable_soldiers > effective_soldiers:
@@ -655,7 +674,7 @@ class GameState:
                     to_tile.owner = from_tile.owner
                     to_tile.soldiers = movable_soldiers - effective_soldiers
                     # 如果是墙，被占领后变为平原
-                    if to_tile.terrain_type == TerrainType.WALL:
+                    if to_tile.terrain_type is _WALL:
                         to_tile.terrain_type = TerrainType.PLAIN
                         to_tile.required_soldiers = 0  # 平原无需士兵即可占领
                 elif movable_soldiers == effective_soldiers:
@@ -698,55 +717,80 @@ class GameState:
         return True
     
     def _generate_soldiers(self):
-        """根据地形生成士兵"""
-        for row in self.tiles:
-            for tile in row:
-                if tile.owner is not None:
-                    if tile.terrain_type == TerrainType.BASE:
-                        # 基地每个游戏刻生成一个士兵
-                        tile.soldiers += 1
-                    elif tile.terrain_type == TerrainType.TOWER:
-                        # 塔楼每个游戏刻生成一个士兵
+        """根据地形生成士兵
+        
+        只有被占领的地块会生成士兵，因此直接遍历按玩家索引的地块集合，
+        不再扫描整张地图。
+        """
+        # 循环内用到的属性和常量先绑定为局部变量
+        base, tower, plain, swamp = _BASE, _TOWER, _PLAIN, _SWAMP
+        plain_grows = self.current_tick % 15 == 0
+        for owned in self.owned_by.values():
+            for tile in owned:
+                terrain_type = tile.terrain_type
+                if terrain_type is base:
+                    # 基地每个游戏刻生成一个士兵
+                    tile.soldiers += 1
+                elif terrain_type is tower:
+                    # 塔楼每个游戏刻生成一个士兵
+                    tile.soldiers += 1
+                elif terrain_type is plain:
+                    # 平原每15个游戏刻生成一个士兵
+                    if plain_grows:
                         tile.soldiers += 1
-                    elif tile.terrain_type == TerrainType.PLAIN:
-                        # 平原每15个游戏刻生成一个士兵
-                        if self.current_tick % 15 == 0:
-                            tile.soldiers += 1
-                    elif tile.terrain_type == TerrainType.SWAMP:
-                        # 沼泽每个游戏刻减少一个士兵
-                        tile.soldiers = max(0, tile.soldiers - 1)
+                elif terrain_type is swamp:
+                    # 沼泽每个游戏刻减少一个士兵
+                    tile.soldiers = max(0, tile.soldiers - 1)
+    
+    def _build_vision_cells(self, vision_range: int) -> Tuple[Tuple[int, ...], ...]:
+        """预先计算每个地块视野范围内的地块下标（tiles_flat中的下标）
+        
+        结果按中心地块的扁平下标排列，地图尺寸固定，只需在初始化时计算一次。
+        """
+        width = self.map_width
+        height = self.map_height
+        # 菱形视野的相对偏移
+        offsets = [
+            (dx, dy)
+            for dy in range(-vision_range, vision_range + 1)
+            for dx in range(-vision_range, vision_range + 1)
+            if abs(dx) + abs(dy) <= vision_range
+        ]
+        return tuple(
+            tuple(
+                (y + dy) * width + (x + dx)
+                for dx, dy in offsets
+                if 0 <= x + dx < width and 0 <= y + dy < height
+            )
+            for y in range(height)
+            for x in range(width)
+        )
     
     def update_fog_of_war(self):
-        """更新战争迷雾"""
-        # 首先将所有地块的可见性重置为False
-        for row in self.tiles:
-            for tile in row:
-                for player_id in self.players:
-                    tile.visibility[player_id] = False
+        """更新战争迷雾
+        
+        对每个玩家先把其所有地块的视野下标合并成一个集合，
+        重叠的视野区域只写入一次可见位。
+        """
+        tiles = self.tiles_flat
+        # 首先将所有地块的可见性重置为不可见
+        for tile in tiles:
+            tile.visibility_bits = 0
         
         # 为每个玩家计算可见范围
-        for player_id, player in self.players.items():
-            # 找出该玩家拥有的所有地块
-            owned_tiles = []
-            for row in self.tiles:
-                for tile in row:
-                    if tile.owner and tile.owner.id == player_id:
-                        owned_tiles.append(tile)
-            
-            # 对于每个拥有的地块，设置周围一定范围为可见
-            for tile in owned_tiles:
-                self._set_visibility_around_tile(tile, player_id)
-    
-    def _set_visibility_around_tile(self, center_tile: Tile, player_id: int, vision_range: int = 2):
-        """设置指定地块周围的可见范围"""
-        for y in range(max(0, center_tile.y - vision_range), 
-                      min(self.map_height, center_tile.y + vision_range + 1)):
-            for x in range(max(0, center_tile.x - vision_range), 
-                          min(self.map_width, center_tile.x + vision_range + 1)):
-                # 计算曼哈顿距离
-                distance = abs(x - center_tile.x) + abs(y - center_tile.y)
-                if distance <= vision_range:
-                    self.tiles[y][x].visibility[player_id] = True
+        owned_by = self.owned_by
+        vision_cells = self.vision_cells
+        width = self.map_width
+        for player_id in self.players:
+            owned = owned_by.get(player_id)
+            if not owned:
+                continue
+            visible = set()
+            for tile in owned:
+                visible.update(vision_cells[tile.y * width + tile.x])
+            mask = self._get_visibility_mask(player_id)
+            for index in visible:
+                tiles[index].visibility_bits |= mask
     
     def _check_game_over(self):
         """检查游戏是否结束"""
@@ -766,14 +810,9 @@ class GameState:
     
     def get_player_stats(self, player_id: int):
         """获取玩家的统计数据（总兵力和占领地块数量）"""
-        total_soldiers = 0
-        owned_tiles = 0
-        
-        for row in self.tiles:
-            for tile in row:
-                if tile.owner and tile.owner.id == player_id:
-                    total_soldiers += tile.soldiers
-                    owned_tiles += 1
+        owned = self.owned_by.get(player_id, ())
+        total_soldiers = sum(tile.soldiers for tile in owned)
+        owned_tiles = len(owned)
         
         return {
             'total_soldiers': total_soldiers,
@@ -795,23 +834,22 @@ class GameState:
         if not eliminated_player or not conqueror_player:
             return
         
-        # 转移地块所有权和兵力
-        for row in self.tiles:
-            for tile in row:
-                if tile.owner and tile.owner.id == eliminated_player_id:
-                    # 转移地块所有权
-                    tile.owner = conqueror_player
-                    
-                    # 如果是基地，更新占领者的基地位置
-                    if tile.terrain_type == TerrainType.BASE:
-                        # 清除原占领者的基地位置（如果有）
-                        if conqueror_player.base_position:
-                            old_base_x, old_base_y = conqueror_player.base_position
-                            if 0 <= old_base_x < self.map_width and 0 <= old_base_y < self.map_height:
-                                self.tiles[old_base_y][old_base_x].terrain_type = TerrainType.PLAIN
-                        
-                        # 设置新的基地位置
-                        conqueror_player.base_position = (tile.x, tile.y)
+        # 转移地块所有权和兵力（按行优先顺序处理，保证基地转移结果确定）
+        eliminated_tiles = sorted(self.owned_by.get(eliminated_player_id, ()), key=lambda t: (t.y, t.x))
+        for tile in eliminated_tiles:
+            # 转移地块所有权
+            tile.owner = conqueror_player
+            
+            # 如果是基地，更新占领者的基地位置
+            if tile.terrain_type is _BASE:
+                # 清除原占领者的基地位置（如果有）
+                if conqueror_player.base_position:
+                    old_base_x, old_base_y = conqueror_player.base_position
+                    if 0 <= old_base_x < self.map_width and 0 <= old_base_y < self.map_height:
+                        self.tiles[old_base_y][old_base_x].terrain_type = TerrainType.PLAIN
+                
+                # 设置新的基地位置
+                conqueror_player.base_position = (tile.x, tile.y)
         
         # 将被淘汰玩家设置为旁观者
         eliminated_player.eliminate()
@@ -851,7 +889,7 @@ class GameState:
         if not (0 <= to_x < self.map_width and 0 <= to_y < self.map_height):
             return False
         
-        from_tile = self.tiles[from_y][from_x]
+        from_tile = self.tiles_flat[from_y * self.map_width + from_x]
         
         # 检查玩家所有权和可通行性
         if from_tile.owner is None or from_tile.owner.id != player_id:
@@ -859,13 +897,13 @@ class GameState:
         if from_tile.soldiers <= 0:
             return False
         
-        to_tile = self.tiles[to_y][to_x]
+        to_tile = self.tiles_flat[to_y * self.map_width + to_x]
         if not to_tile.is_passable():
             return False
         
         # 将移动操作添加到对应玩家的队列中
         if player_id not in self.pending_moves:
-            self.pending_moves[player_id] = []
+            self.pending_moves[player_id] = deque()
         
         self.pending_moves[player_id].append({
             'from_x': from_x,
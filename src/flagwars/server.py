@@ -1037,12 +1037,15 @@ class GameManager:
         
         game = self.games[game_id]
         
+        # 排行榜对所有玩家相同，每次广播只计算一次
+        leaderboard = game.get_all_players_stats()
+        
         # 为每个玩家发送个性化的游戏状态
         for player_id, player in game.players.items():
             if player_id in self.connections[game_id]:
                 handler = self.connections[game_id][player_id]
                 # 为每个玩家获取个性化的游戏状态（包含战争迷雾）
-                personalized_state = self.get_game_state(game_id, player_id)
+                personalized_state = self.get_game_state(game_id, player_id, leaderboard)
                 response = {
                     'type': 'game_state',
                     'game_state': personalized_state
@@ -1101,8 +1104,11 @@ class GameManager:
         
         return game_state.move_soldiers(from_x, from_y, to_x, to_y, player_id)
     
-    def get_game_state(self, game_id: str, player_id: int = None) -> dict:
-        """获取游戏状态"""
+    def get_game_state(self, game_id: str, player_id: int = None, leaderboard: list = None) -> dict:
+        """获取游戏状态
+        
+        leaderboard 为调用方预先算好的排行榜（广播时所有玩家共用），为None时在此计算。
+        """
         if game_id not in self.games:
             return {}
         
@@ -1134,7 +1140,9 @@ class GameManager:
             state_dict['countdown'] = 0
         
         # 获取排行榜数据
-        state_dict['leaderboard'] = game_state.get_all_players_stats()
+        if leaderboard is None:
+            leaderboard = game_state.get_all_players_stats()
+        state_dict['leaderboard'] = leaderboard
         
         # 添加移动箭头数据（仅当前玩家可见）
         if player_id and player_id in game_state.movement_arrows:
@@ -1142,11 +1150,17 @@ class GameManager:
         else:
             state_dict['movement_arrows'] = []
         
+        # 当前玩家的可见性掩码（未初始化可见性的玩家不受战争迷雾限制）
+        fog_mask = game_state.visibility_masks.get(player_id) if player_id else None
+        
         # 序列化地图
+        tiles = game_state.tiles
+        serialized_tiles = state_dict['tiles']
         for y in range(game_state.map_height):
             row = []
+            tiles_row = tiles[y]
             for x in range(game_state.map_width):
-                tile = game_state.tiles[y][x]
+                tile = tiles_row[x]
                 
                 # 如果是旁观者，显示完整地图信息
                 if is_spectator:
@@ -1160,7 +1174,7 @@ class GameManager:
                         'is_fog': False  # 旁观者无战争迷雾
                     }
                 # 如果指定了玩家ID且该地块对玩家不可见，则隐藏详细信息
-                elif player_id and player_id in tile.visibility and not tile.visibility.get(player_id, False):
+                elif fog_mask is not None and not tile.visibility_bits & fog_mask:
                     # 对于不可见的地块，显示真实地形信息但隐藏所有者和士兵数量
                     tile_data = {
                         'x': tile.x,
@@ -1184,7 +1198,7 @@ class GameManager:
                     }
                 
                 row.append(tile_data)
-            state_dict['tiles'].append(row)
+            serialized_tiles.append(row)
         
         # 序列化玩家，包含准备状态和旁观者状态
         for pid, player in game_state.players.items():
@@ -1340,10 +1354,8 @@ class GameManager:
             if game_state.winner and game_state.winner.id in self.player_user_mapping:
                 winner_user_id = self.player_user_mapping[game_state.winner.id]
             
-            # 记录游戏
-            game_db_id = db.record_game(game_id, winner_user_id, game_duration, game_state.current_tick)
-            
-            # 记录每个玩家的游戏结果
+            # 收集每个玩家的游戏结果
+            game_players = []
             for player_id, player in game_state.players.items():
                 if player_id in self.player_user_mapping:
                     user_id = self.player_user_mapping[player_id]
@@ -1352,21 +1364,26 @@ class GameManager:
                     player_stats = game_state.get_player_stats(player_id)
                     final_rank = player_stats.get('rank', len(game_state.players))
                     
-                    # 记录游戏参与者信息
-                    db.record_game_player(
-                        game_db_id, user_id, final_rank, player.is_alive
-                    )
-                    
-                    # 只在游戏正常结束时更新用户统计
-                    if game_state.game_over_type == 'normal':
-                        db.update_user_stats(user_id, {
-                            'won': player == game_state.winner
-                        })
-                        
-                        # 为胜利者增加一个"旗"作为奖励
-                        if player == game_state.winner:
-                            db.add_user_flags(user_id, 1)
-                            logging.info(f"为胜利者 {player.name} (用户ID: {user_id}) 增加了1个旗")
+                    game_players.append({
+                        'user_id': user_id,
+                        'final_rank': final_rank,
+                        'survived': player.is_alive,
+                        'won': player == game_state.winner
+                    })
+            
+            # 游戏记录、参与者、胜负统计和胜利奖励在一个事务中写入；
+            # 只在游戏正常结束时更新用户统计
+            normal_end = game_state.game_over_type == 'normal'
+            db.finalize_match(
+                game_id, winner_user_id, game_duration, game_state.current_tick,
+                game_players, update_stats=normal_end
+            )
+            
+            # finalize_match只给game_players中won为True的用户发放奖励，日志与之保持一致
+            if normal_end:
+                for p in game_players:
+                    if p['won']:
+                        logging.info(f"为胜利者 {game_state.winner.name} (用户ID: {p['user_id']}) 增加了1个旗")
             
             logging.info(f"游戏 {game_id} 结果已记录到数据库，结束类型: {game_state.game_over_type}")
             
@@ -1702,18 +1719,23 @@ def make_app():
 
 def main(port: int = 8888, debug: bool = False, host: str = '0.0.0.0'):
     """主函数"""
-    import argparse
+    import sys
     
-    # 解析命令行参数
-    parser = argparse.ArgumentParser(description='FlagWars游戏服务器')
-    parser.add_argument('--port', type=int, default=port, help='服务器监听端口 (默认: 8888)')
-    args = parser.parse_args()
+    # 解析命令行参数（没有额外参数时直接使用传入的默认值，不构建解析器）
+    if len(sys.argv) > 1:
+        import argparse
+        parser = argparse.ArgumentParser(description='FlagWars游戏服务器')
+        parser.add_argument('--port', type=int, default=port, help='服务器监听端口 (默认: 8888)')
+        port = parser.parse_args().port
     
     logging.basicConfig(level=logging.INFO)
     
     app = make_app()
     server = httpserver.HTTPServer(app)
-    server.listen(args.port, address=host)
+    server.listen(port, address=host)
+    
+    # 每天执行一次数据库维护（更新查询统计信息、截断WAL文件）
+    ioloop.PeriodicCallback(db.maintenance, 24 * 60 * 60 * 1000).start()
     
     # 获取本机IP地址
     import socket
@@ -1726,14 +1748,17 @@ def main(port: int = 8888, debug: bool = False, host: str = '0.0.0.0'):
     except:
         local_ip = "未知"
     
-    logging.info(f"FlagWars服务器启动在 http://localhost:{args.port}")
-    logging.info(f"局域网访问地址: http://{local_ip}:{args.port}")
+    logging.info(f"FlagWars服务器启动在 http://localhost:{port}")
+    logging.info(f"局域网访问地址: http://{local_ip}:{port}")
     logging.info("按 Ctrl+C 停止服务器")
     
     try:
         ioloop.IOLoop.current().start()
     except KeyboardInterrupt:
         logging.info("服务器停止")
+    finally:
+        # 写入尚未落盘的最后登录时间并关闭数据库连接
+        db.close()
 
 
 if __name__ == "__main__":
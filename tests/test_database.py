@@ -0,0 +1,140 @@
+"""
+FlagWars数据库模块测试
+
+使用标准库unittest编写，可直接运行：
+    python -m unittest discover -s tests
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+Database = None
+_module_dir = None
+
+
+def setUpModule():
+    """导入数据库模块
+
+    模块导入时会在当前目录创建全局数据库 flagwars.db，
+    因此在临时目录中导入，避免在仓库目录留下数据库文件。
+    """
+    global Database, _module_dir
+    _module_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(_module_dir)
+    try:
+        from flagwars.database import Database as _Database, db
+    finally:
+        os.chdir(cwd)
+    db.close()
+    Database = _Database
+
+
+def tearDownModule():
+    shutil.rmtree(_module_dir, ignore_errors=True)
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """每个测试使用独立的临时数据库"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.tmp_dir, "test.db"))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class TransactionTest(DatabaseTestCase):
+    """transaction() 的提交与回滚"""
+
+    def _count_users(self):
+        with self.db.get_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def test_exception_rolls_back(self):
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction() as conn:
+                conn.execute(
+                    "INSERT INTO users (username, password_hash, salt) VALUES ('alice', 'x', 'y')"
+                )
+                raise RuntimeError("boom")
+        self.assertEqual(self._count_users(), 0)
+
+    def test_original_error_kept_when_sqlite_already_rolled_back(self):
+        # INSERT OR ROLLBACK 违反唯一约束时SQLite会自行回滚事务，
+        # transaction() 不应再执行ROLLBACK而抛出"no transaction is active"
+        insert = "INSERT OR ROLLBACK INTO users (username, password_hash, salt) VALUES ('alice', 'x', 'y')"
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.db.transaction() as conn:
+                conn.execute(insert)
+                conn.execute(insert)
+        self.assertEqual(self._count_users(), 0)
+
+        # 连接归还连接池后仍可正常使用
+        with self.db.transaction() as conn:
+            conn.execute(insert)
+        self.assertEqual(self._count_users(), 1)
+
+
+class UnlockedMusicOrderTest(DatabaseTestCase):
+    """已解锁音乐按解锁先后顺序返回，而不是按文件名排序"""
+
+    def setUp(self):
+        super().setUp()
+        self.user_id = self.db.create_user("alice", "password", "alice@example.com")
+        for name in ("zeta.mp3", "alpha.mp3", "mid.mp3"):
+            self.db.unlock_bgm(self.user_id, name)
+
+    def test_get_unlocked_music_keeps_unlock_order(self):
+        self.assertEqual(
+            self.db.get_unlocked_bgm(self.user_id),
+            ["Whispers-of-Strategy.mp3", "zeta.mp3", "alpha.mp3", "mid.mp3"],
+        )
+        self.assertEqual(self.db.get_unlocked_victory_music(self.user_id), ["royal-vict.mp3"])
+
+    def test_music_settings_keep_unlock_order(self):
+        for name in ("weird-horn-vict.mp3", "folk-vict.mp3"):
+            self.db.unlock_victory_music(self.user_id, name)
+        settings = self.db.get_user_music_settings(self.user_id)
+        self.assertEqual(
+            settings["unlocked_bgm"],
+            ["Whispers-of-Strategy.mp3", "zeta.mp3", "alpha.mp3", "mid.mp3"],
+        )
+        self.assertEqual(
+            settings["unlocked_victory"],
+            ["royal-vict.mp3", "weird-horn-vict.mp3", "folk-vict.mp3"],
+        )
+
+    def test_music_settings_without_unlocks(self):
+        settings = self.db.get_user_music_settings(self.user_id + 1)
+        self.assertEqual(settings["unlocked_bgm"], [])
+        self.assertEqual(settings["unlocked_victory"], [])
+
+
+
+class VerifySessionTest(DatabaseTestCase):
+    """会话校验只返回身份信息"""
+
+    def test_verify_session_returns_identity_only(self):
+        user_id = self.db.create_user("alice", "password", "alice@example.com")
+        token = self.db.create_session(user_id)
+        user = self.db.verify_session(token)
+        self.assertEqual(set(user), {"id", "username", "email", "expires_at"})
+        self.assertEqual(user["id"], user_id)
+        self.assertEqual(user["username"], "alice")
+        self.assertEqual(user["email"], "alice@example.com")
+
+    def test_invalid_session(self):
+        self.assertIsNone(self.db.verify_session("no-such-token"))
+
+
+if __name__ == "__main__":
+    unittest.main()